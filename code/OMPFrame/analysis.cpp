@@ -21,6 +21,7 @@ vector<float> landscapeAlong(State* s, VectorXf& g, float max_stepsize, int samp
     float d_stepsize = max_stepsize / samples;
     State* s_temp = new State(s->N);
     s_temp->boundary = s->boundary;
+    s_temp->setThreads(s->threads);
 
     for (int i = 0; i < samples; i++) {
         s_temp->loadFromData(s->configuration.data());
@@ -41,9 +42,10 @@ vector<vector<float>> _landscapeOnGradientSections(State* s, float max_stepsize,
     vector<vector<float>> res; res.reserve(2 * samples + 1);
     float d_stepsize = max_stepsize / samples;
     VectorXf g = normalize(s->CalGradient<Normal>());
-    VectorXf u = randomUnitVector(s->N);
+    VectorXf u = randomUnitVector(dof * s->N);
     State* s_temp = new State(s->N);
     s_temp->boundary = s->boundary;
+    s_temp->setThreads(s->threads);
 
     for (int i = -samples; i <= samples; i++) {
         s_temp->loadFromData(s->configuration.data());
@@ -12,7 +12,7 @@
 #endif
 using namespace Eigen;
 
-#define CORES 4
+#define CORES 4                 // default number of threads of a state, see `State::setThreads`
 #define NAN_IF_PENETRATE false
 #define ENABLE_NAN_CHECK true
 #define ENABLE_OUT_CHECK true
@@ -27,6 +27,7 @@ const float pi = 3.141592654;
 enum HowToCalGradient{ Normal, AsDisks, LBFGS, Test, HowToCalGradient_Count };
 enum PotentialFunc{ Hertzian, ScreenedCoulomb, Power, PotentialFunc_Count };
 enum HashFunc { _h2pi, _h4 };
+enum Observable { ObMeanDistance, ObMeanZ, ObMeanS, ObPhi4, ObPhi6, ObSi, Observable_Count };
 
 struct xyt { 
     float x, y, t, unused; 
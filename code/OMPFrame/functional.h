@@ -92,17 +92,56 @@ struct D4ScalarFunc
 {
     float (*data)[n2][n3];
     size_t capacity = n1 * n2 * n3;
+    bool mapped;                    // if true, `data` is a read-only view of a file
 
     D4ScalarFunc() {
         data = new float[n1][n2][n3];
+        mapped = false;
     }
 
     void read(const char* filename) {
         readArrayFromFile<float>((float*)data, capacity, filename);
     }
+    void map(const char* filename) {
+        void* ptr = mapFileReadonly(filename, capacity * sizeof(float));
+        if (ptr == NULL) {
+            read(filename);         // fall back to a private copy
+            return;
+        }
+        if (!mapped) delete[] data;
+        data = (float(*)[n2][n3])ptr;
+        mapped = true;
+    }
     void write(const char* filename) {
         writeArrayToFile<float>((float*)data, capacity, filename);
     }
+    /*
+        FNV-1a hashes of blocks of the table (computed in parallel), combined in order.
+        It verifies a table in memory, so that the file is not read twice.
+    */
+    uint64_t checksum() {
+        const uint64_t offset = 14695981039346656037ull, prime = 1099511628211ull;
+        const long long block = 1 << 20;
+        long long n_blocks = (capacity + block - 1) / block;
+        vector<uint64_t> hs(n_blocks);
+        uint32_t* words = (uint32_t*)data;
+    #pragma omp parallel for num_threads(CORES)
+        for (long long b = 0; b < n_blocks; b++) {
+            long long end = std::min((b + 1) * block, (long long)capacity);
+            uint64_t h = offset;
+            for (long long i = b * block; i < end; i++) {
+                h ^= words[i];
+                h *= prime;
+            }
+            hs[b] = h;
+        }
+        uint64_t h = offset;
+        for (uint64_t x : hs) {
+            h ^= x;
+            h *= prime;
+        }
+        return h;
+    }
 };
 
 /*
@@ -116,4 +155,19 @@ struct RollList {
     ty& operator[](int idx) {
         return data[idx % m];
     }
+};
+
+/*
+    RollList of a length given at runtime
+*/
+template<typename ty>
+struct DynamicRollList {
+    vector<ty> data;
+
+    void resize(int m) {
+        data.resize(m);
+    }
+    ty& operator[](int idx) {
+        return data[idx % data.size()];
+    }
 };
\ No newline at end of file
@@ -68,24 +68,32 @@ int getStateIterations(void* state_ptr)
     return s->ge.size();
 }
 
+/*
+    Copy an array to the result buffer of the state, which is read (and copied) by python.
+*/
+static float* toResultBuffer(State* s, const float* src, int n)
+{
+    s->results.resize(n);
+    memcpy(s->results.data(), src, n * sizeof(float));
+    return s->results.data();
+}
+
 void* getStateResidualForce(void* state_ptr)
 {
-    static VectorXf res;
     State* s = reinterpret_cast<State*>(state_ptr);
-    res = s->CalGradient<Normal>();
-    return res.data();
+    VectorXf res = s->CalGradient<Normal>();
+    return toResultBuffer(s, res.data(), res.size());
 }
 
 float getStateMaxResidualForce(void* state_ptr)
 {
-    static VectorXf temp;
     State* s = reinterpret_cast<State*>(state_ptr);
     VectorXf g = VectorXf::Zero(s->N);
 
-    temp = s->CalGradient<Normal>();
+    VectorXf temp = s->CalGradient<Normal>();
     xyt* ptr = (xyt*)temp.data();
     
-#pragma omp parallel for num_threads(CORES)
+#pragma omp parallel for num_threads(s->threads)
     for (int i = 0; i < s->N; i++) {
         g[i] = ptr[i].amp2();
     }
@@ -110,6 +118,29 @@ int getSiblingId(void* state_ptr)
     return s->sibling_id;
 }
 
+int getCores()
+{
+    return CORES;
+}
+
+int getStateRebuilds(void* state_ptr)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    return s->verletRebuilds();
+}
+
+int getStateGradientEvaluations(void* state_ptr)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    return s->gradient_evaluations;
+}
+
+int getStateEnergyEvaluations(void* state_ptr)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    return s->energy_evaluations;
+}
+
 void setStateData(void* state_ptr, void* data_src)
 {
     State* s = reinterpret_cast<State*>(state_ptr);
@@ -136,14 +167,34 @@ void renewState(void* state_ptr)
 }
 
 void readPotential(int n, float d)
+{
+    readPotentialFrom(n, d, potential_file_name, false);
+}
+
+void readPotentialFrom(int n, float d, const char* filename, bool use_mmap)
 {
     global->rod = new Rod(n, d);
-    global->rod->fv->read(potential_file_name);
+    if (use_mmap) {
+        global->rod->fv->map(filename);
+    }
+    else {
+        global->rod->fv->read(filename);
+    }
 }
 
 void writePotential()
 {
-    global->rod->fv->write(potential_file_name);
+    writePotentialTo(potential_file_name);
+}
+
+void writePotentialTo(const char* filename)
+{
+    global->rod->fv->write(filename);
+}
+
+unsigned long long potentialChecksum()
+{
+    return global->rod->fv->checksum();
 }
 
 int getPotentialId()
@@ -154,15 +205,9 @@ int getPotentialId()
 template<HowToCalGradient how>
 float* landscapeAlongGradient_helper(void* state_ptr, float max_stepsize, int samples)
 {
-    static float* res = NULL;
-    if (res) {
-        delete[] res; res = NULL;
-    }
-    res = new float[samples];
     State* s = reinterpret_cast<State*>(state_ptr);
     vector<float> energies = _landscapeAlongGradient<how>(s, max_stepsize, samples);
-    memcpy(res, energies.data(), samples * sizeof(float));
-    return res;
+    return toResultBuffer(s, energies.data(), samples);
 }
 
 float* landscapeAlongGradient(void* state_ptr, float max_stepsize, int samples) 
@@ -177,17 +222,13 @@ float* landscapeLBFGS(void* state_ptr, float max_stepsize, int samples)
 
 float* landscapeOnGradientSections(void* state_ptr, float max_stepsize, int samples)
 {
-    static float* res = NULL;
-    if (res) {
-        delete[] res; res = NULL;
-    }
-    res = new float[(2 * samples + 1) * samples];
     State* s = reinterpret_cast<State*>(state_ptr);
     vector<vector<float>> energies = _landscapeOnGradientSections(s, max_stepsize, samples);
+    s->results.resize((2 * samples + 1) * samples);
     for (int i = 0; i < 2 * samples + 1; i++) {
-        memcpy(res + i * samples, energies[i].data(), samples * sizeof(float));
+        memcpy(s->results.data() + i * samples, energies[i].data(), samples * sizeof(float));
     }
-    return res;
+    return s->results.data();
 }
 
 float meanS(void* state_ptr, float gamma)
@@ -204,28 +245,59 @@ float absPhi(void* state_ptr, float gamma, int p)
 
 float* Si(void* state_ptr, float gamma)
 {
-    static float* res = NULL;
     State* s = reinterpret_cast<State*>(state_ptr);
-    if (res) {
-        delete[] res; res = NULL;
-    }
-    res = new float[s->N];
     VectorXf si = s->orderS(gamma);
-    memcpy(res, si.data(), s->N * sizeof(float));
-    return res;
+    return toResultBuffer(s, si.data(), s->N);
 }
 
 float* neighborAngleDist(void* state_ptr, float gamma, int bins)
 {
-    static float* res = NULL;
     State* s = reinterpret_cast<State*>(state_ptr);
-    if (res) {
-        delete[] res; res = NULL;
-    }
-    res = new float[bins];
     VectorXf hist = s->neighborAngleDist(gamma, bins);  // can return but cause segment fault?
-    memcpy(res, hist.data(), bins * sizeof(float));
-    return res;
+    return toResultBuffer(s, hist.data(), bins);
+}
+
+void observables(void* state_ptr, float gamma, int* props, int n_props, float* dst)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    s->observables(gamma, props, n_props, dst);
+}
+
+/*
+    Observables of a trajectory. frames: float[n_frames][N][4], boundaries: float[n_frames][2] of (A, B).
+    Frames are distributed over `threads` threads, each of which reloads one single-threaded state.
+    dst: float[n_frames][size], where size is the total size of the observables. Results of a crashed frame are nan.
+    Temporary states are taken from the pool: the caller must hold the lock of the pool (`Kernel.lock`).
+*/
+void observablesBatch(float* frames, float* boundaries, int n_frames, int N, float gamma,
+    int* props, int n_props, int threads, float* dst)
+{
+    vector<State*> states(threads);
+    int size = 0;
+    for (int t = 0; t < threads; t++) {
+        states[t] = global->newState(N);
+        states[t]->setThreads(1);
+    }
+    for (int k = 0; k < n_props; k++) {
+        size += states[0]->observableSize(props[k]);
+    }
+#pragma omp parallel for schedule(dynamic, 1) num_threads(threads)
+    for (int i = 0; i < n_frames; i++) {
+        State* s = states[omp_get_thread_num()];
+        float* res = dst + (size_t)i * size;
+        try {
+            s->setBoundary(boundaries[2 * i], boundaries[2 * i + 1]);
+            s->loadFromData(frames + (size_t)i * dof * N);
+            s->observables(gamma, props, n_props, res);
+        }
+        catch (int exception) {
+            std::fill(res, res + size, NAN);
+        }
+    }
+    for (int t = 0; t < threads; t++) {
+        states[t]->resetSettings();
+        global->states.free(states[t]);
+    }
 }
 
 void* getStateMaxGradOrEnergy(void* state_ptr)
@@ -245,6 +317,18 @@ void setBoundary(void* state_ptr, float boundary_a, float boundary_b)
     s->setBoundary(boundary_a, boundary_b);
 }
 
+void setThreads(void* state_ptr, int threads)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    s->setThreads(threads);
+}
+
+void setVerletSkin(void* state_ptr, float skin)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    s->setVerletSkin(skin);
+}
+
 void singleStep(void* state_ptr, int mode, float step_size)
 {
     typedef VectorXf (State::* Func)();
@@ -282,6 +366,75 @@ float eqMix(void* state_ptr, int max_iterations)
     return s->eqMix(max_iterations);
 }
 
+float eqFIRE(void* state_ptr, int max_iterations)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    return s->eqFIRE(max_iterations);
+}
+
+void setOptimizerParams(void* state_ptr, int lbfgs_m, double max_gradient, double min_energy,
+    int energy_stride, int energy_stride_gd, double step_size, double step_size_lbfgs, double step_decay,
+    double min_step_size)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    s->optimizer = { lbfgs_m, max_gradient, min_energy, energy_stride, energy_stride_gd,
+        step_size, step_size_lbfgs, step_decay, min_step_size };
+}
+
+void setFireParams(void* state_ptr, float dt, float dt_max, float max_step, int n_min,
+    float f_inc, float f_dec, float alpha_start, float f_alpha)
+{
+    State* s = reinterpret_cast<State*>(state_ptr);
+    s->fire = { dt, dt_max, max_step, n_min, f_inc, f_dec, alpha_start, f_alpha };
+}
+
+/*
+    Relax a batch of states on one thread pool. Each state runs single-threaded, and
+    idle threads take the next unfinished state (dynamic schedule), so that states converging
+    early do not leave cores idle. `method`: 0 = GD, 1 = LineGD, 2 = LBFGS, 3 = Mix, 4 = FIRE.
+    The number of threads of each state is restored afterwards.
+    Output: energies (NAN if the state crashes, or if `method` is invalid) and numbers of iterations of each state.
+*/
+void equilibriumBatch(void** state_ptrs, int n_states, int method, int* max_iterations, int threads,
+    float* energies, int* iterations)
+{
+    static EquilibriumMethod funcs[] = {
+        &State::equilibriumGD,
+        &State::eqLineGD,
+        &State::eqLBFGS,
+        &State::eqMix,
+        &State::eqFIRE,
+    };
+    const int n_methods = sizeof(funcs) / sizeof(funcs[0]);
+
+    if (method < 0 || method >= n_methods) {
+        cout << "Invalid equilibrium method: " << method << endl;
+        std::fill(energies, energies + n_states, NAN);
+        std::fill(iterations, iterations + n_states, 0);
+        return;
+    }
+    vector<int> threads_of_states(n_states);
+    for (int i = 0; i < n_states; i++) {
+        State* s = reinterpret_cast<State*>(state_ptrs[i]);
+        threads_of_states[i] = s->threads;
+        s->setThreads(1);
+    }
+#pragma omp parallel for schedule(dynamic, 1) num_threads(threads)
+    for (int i = 0; i < n_states; i++) {
+        State* s = reinterpret_cast<State*>(state_ptrs[i]);
+        try {
+            energies[i] = (s->*funcs[method])(max_iterations[i]);
+        }
+        catch (int exception) {
+            energies[i] = NAN;
+        }
+        iterations[i] = s->iterations;
+    }
+    for (int i = 0; i < n_states; i++) {
+        reinterpret_cast<State*>(state_ptrs[i])->setThreads(threads_of_states[i]);
+    }
+}
+
 float fastPotential(float x, float y, float t)
 {
     return global->rod->potentialNoInterpolate({ x,y,t });
@@ -18,22 +18,32 @@ PairInfo::PairInfo()
 {
 }
 
-PairInfo::PairInfo(int N)
+PairInfo::PairInfo(int N, int threads)
 {
     this->N = N;
-    for (int i = 0; i < CORES; i++) {
-        info_pp[i].reserve(N * N / 2);
-        info_pw[i].reserve(N);
+    this->threads = threads;
+    info_pp.resize(threads);
+    info_pw.resize(threads);
+    for (int i = 0; i < threads; i++) {
+        info_pp[i].reserve(N * N / 2 / threads);
+        info_pw[i].reserve(N / threads);
     }
-    g_buffer = Maybe<GradientBuffer*>(new GradientBuffer(N));
-    e_buffer = Maybe<EnergyBuffer*>(new EnergyBuffer(N));
+    g_buffer = Maybe<GradientBuffer*>(new GradientBuffer(N, threads));
+    e_buffer = Maybe<EnergyBuffer*>(new EnergyBuffer(N, threads));
     graph = Maybe<Graph<neighbors>*>(new Graph<neighbors>(N));
 }
 
+PairInfo::~PairInfo()
+{
+    delete g_buffer.obj;
+    delete e_buffer.obj;
+    delete graph.obj;
+}
+
 void PairInfo::clear()
 {
-#pragma omp parallel for num_threads(CORES)
-    for (int i = 0; i < CORES; i++) {
+#pragma omp parallel for num_threads(threads)
+    for (int i = 0; i < threads; i++) {
         info_pp[i].clear();
         info_pw[i].clear();
     }
@@ -104,7 +114,7 @@ void calEnergy(PairInfo* pinfo, EnergyBuffer* ge) {
     ge->clear();
 
     // for pp
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(pinfo->threads)
     {
         int idx = omp_get_thread_num();
         int n = pinfo->info_pp[idx].size();
@@ -114,7 +124,7 @@ void calEnergy(PairInfo* pinfo, EnergyBuffer* ge) {
         }
     }
     // for pw 
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(pinfo->threads)
     {
         int idx = omp_get_thread_num();
         int n = pinfo->info_pw[idx].size();
@@ -150,7 +160,7 @@ PairInfo* PairInfo::filterAsRods(float gamma)
     if (!is_filtered) {
         is_filtered = true;
         RodContactCondition condition(gamma);
-    #pragma omp parallel num_threads(CORES)
+    #pragma omp parallel num_threads(threads)
         {
             int idx = omp_get_thread_num();
             filter(info_pp[idx], condition);
@@ -160,11 +170,12 @@ PairInfo* PairInfo::filterAsRods(float gamma)
 }
 
 template<bool checkId2>
-int contactNumber(vector<ParticlePair>* vp, float gamma) {
-    int z[CORES] = { 0 };
+int contactNumber(vector<vector<ParticlePair>>& vp, float gamma) {
+    int threads = vp.size();
+    vector<int> z(threads, 0);
     int sum_z = 0;
     RodContactCondition condition(gamma);
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(threads)
     {
         int idx = omp_get_thread_num();
         int n = vp[idx].size();
@@ -182,7 +193,7 @@ int contactNumber(vector<ParticlePair>* vp, float gamma) {
             }
         }
     }
-    for (int i = 0; i < CORES; i++) {
+    for (int i = 0; i < threads; i++) {
         sum_z += z[i];
     }
     return sum_z;
@@ -199,12 +210,12 @@ inline static float dist(ParticlePair& ijxytt) {
 
 float PairInfo::meanDistance(float gamma)
 {
-    int z[CORES] = { 0 };
-    float d[CORES] = { 0.0f };
+    vector<int> z(threads, 0);
+    vector<float> d(threads, 0.0f);
     int sum_z = 0;
     float sum_d = 0.0f;
     RodContactCondition condition(gamma);
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(threads)
     {
         int idx = omp_get_thread_num();
         int n = info_pp[idx].size();
@@ -216,7 +227,7 @@ float PairInfo::meanDistance(float gamma)
             }
         }
     }
-    for (int i = 0; i < CORES; i++) {
+    for (int i = 0; i < threads; i++) {
         sum_z += z[i];
         sum_d += d[i];
     }
@@ -225,7 +236,7 @@ float PairInfo::meanDistance(float gamma)
 
 void getGraph(PairInfo* pinfo, Graph<neighbors>* graph) {
     // cannot use omp here, because `Graph<...>` is not a multithread container.
-    for (int idx = 0; idx < CORES; idx++) {
+    for (int idx = 0; idx < pinfo->threads; idx++) {
         for (auto& pair : pinfo->info_pp[idx]) {
             graph->add_pair(pair.id1, pair.id2);
         }
@@ -245,19 +256,26 @@ GradientBuffer::GradientBuffer()
 {
 }
 
-GradientBuffer::GradientBuffer(int N)
+GradientBuffer::GradientBuffer(int N, int threads)
 {
     this->N = N;
-    for (int i = 0; i < CORES; i++) {
+    buffers.resize(threads);
+    for (int i = 0; i < threads; i++) {
         buffers[i] = VectorXf::Zero(dof * N);
     }
     result = Maybe<VectorXf*>(new VectorXf(dof * N));
 }
 
+GradientBuffer::~GradientBuffer()
+{
+    delete result.obj;
+}
+
 void GradientBuffer::clear()
 {
-#pragma omp parallel for num_threads(CORES)
-    for (int i = 0; i < CORES; i++) {
+    int threads = buffers.size();
+#pragma omp parallel for num_threads(threads)
+    for (int i = 0; i < threads; i++) {
         buffers[i].setZero();
     }
     result.valid = false;
@@ -265,13 +283,21 @@ void GradientBuffer::clear()
 }
 
 VectorXf GradientBuffer::join()
+{
+    return joined();
+}
+
+/*
+    the sum of buffers, joined in place: valid until the buffer is cleared
+*/
+const VectorXf& GradientBuffer::joined()
 {
     if (!result.valid) {
         result.valid = true;
-        if constexpr (CORES > 1)
+        if (buffers.size() > 1)
         {
-            for (int i = 0; i < CORES; i++) {
-                *result.obj += buffers[i];
+            for (auto& buffer : buffers) {
+                *result.obj += buffer;
             }
         }
         else
@@ -286,16 +312,17 @@ EnergyBuffer::EnergyBuffer()
 {
 }
 
-EnergyBuffer::EnergyBuffer(int N)
+EnergyBuffer::EnergyBuffer(int N, int threads)
 {
     this->N = N;
+    buffers.resize(threads);
     clear();
 }
 
 void EnergyBuffer::clear()
 {
-    for (int i = 0; i < CORES; i++) {
-        buffers[i] = 0;
+    for (auto& buffer : buffers) {
+        buffer = 0;
     }
     result.valid = false;
     result.obj = 0;
@@ -305,8 +332,8 @@ float EnergyBuffer::sum()
 {
     if (!result.valid) {
         result.valid = true;
-        for (int i = 0; i < CORES; i++) {
-            result.obj += buffers[i];
+        for (auto& buffer : buffers) {
+            result.obj += buffer;
         }
     }
     return result.obj;
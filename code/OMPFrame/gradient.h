@@ -7,36 +7,39 @@
 
 struct GradientBuffer
 {
-    VectorXf buffers[CORES];
+    vector<VectorXf> buffers;       // one buffer per thread
     int N;
 
     Maybe<VectorXf*> result;
     
     GradientBuffer();
-    GradientBuffer(int N);
+    GradientBuffer(int N, int threads);
+    ~GradientBuffer();
     void clear();
     VectorXf join();
+    const VectorXf& joined();
 };
 
 struct EnergyBuffer
 {
-    float buffers[CORES];
+    vector<float> buffers;          // one buffer per thread
     int N;
 
     Maybe<float> result;
 
     EnergyBuffer();
-    EnergyBuffer(int N);
+    EnergyBuffer(int N, int threads);
     void clear();
     float sum();
 };
 
 struct PairInfo
 {
-    vector<ParticlePair> info_pp[CORES];
-    vector<ParticlePair> info_pw[CORES];
+    vector<vector<ParticlePair>> info_pp;     // one list per thread
+    vector<vector<ParticlePair>> info_pw;
 
     int N;
+    int threads;
     bool is_filtered;
 
     Maybe<GradientBuffer*> g_buffer;
@@ -44,7 +47,8 @@ struct PairInfo
     Maybe<Graph<neighbors>*> graph;
 
     PairInfo();
-    PairInfo(int N);
+    PairInfo(int N, int threads);
+    ~PairInfo();
     void clear();
     template<HowToCalGradient how> GradientBuffer* CalGradient();
     EnergyBuffer* CalEnergy();
@@ -12,7 +12,7 @@ void calGradient(PairInfo* pinfo, GradientBuffer* ge) {
     ge->clear();
 
     // for pp
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(pinfo->threads)
     {
         int idx = omp_get_thread_num();
         int n = pinfo->info_pp[idx].size();
@@ -28,7 +28,7 @@ void calGradient(PairInfo* pinfo, GradientBuffer* ge) {
         }
     }
     // for pw 
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(pinfo->threads)
     {
         int idx = omp_get_thread_num();
         int n = pinfo->info_pw[idx].size();
@@ -64,5 +64,15 @@ GradientBuffer* PairInfo::CalGradient()
 template<HowToCalGradient how>
 inline VectorXf State::CalGradient() {
     // require: PairInto::CalGradient<how>
-    return this->CollisionDetect()->CalGradient<how>()->join();
+    PairInfo* pair_info = this->CollisionDetect();
+    if (!pair_info->g_buffer.valid) gradient_evaluations++;
+    return pair_info->CalGradient<how>()->join();
+}
+
+template<HowToCalGradient how>
+inline void State::CalGradientInto(VectorXf& dst) {
+    // copy to a preallocated vector, without allocations
+    PairInfo* pair_info = this->CollisionDetect();
+    if (!pair_info->g_buffer.valid) gradient_evaluations++;
+    dst = pair_info->CalGradient<how>()->joined();
 }
\ No newline at end of file
@@ -7,11 +7,19 @@
 const int max_particles_in_cell = 32;
 const int max_grid_size = 256 * 256;
 
-Grid::Grid() {
-	p = new VectorList<int, CORES, grid_single_capacity>[max_grid_size];
+Grid::Grid(int threads) {
+	this->threads = threads;
+	p = new VectorList<int, grid_single_capacity>[max_grid_size];
+	for (int i = 0; i < max_grid_size; i++) {
+		p[i].init(threads);
+	}
 	collision_detect_region = new int[4];
 	id = -1;
 }
+Grid::~Grid() {
+	delete[] p;
+	delete[] collision_detect_region;
+}
 void Grid::init(float cell_size, float boundary_a, float boundary_b) {
 	/*
 		Input:
@@ -37,59 +45,66 @@ int Grid::xlocate(float x) {
 int Grid::ylocate(float y) {
 	return (int)floor(y / a) + yshift;
 }
-VectorList<int, CORES, grid_single_capacity>* Grid::loc(int i, int j) {
+VectorList<int, grid_single_capacity>* Grid::loc(int i, int j) {
 	// x -->i, y -->j
 	return this->p + j * cols + i;
 }
-void Grid::add(int thread_idx, int i, int j, int particle_id) {
-	(this->p + j * cols + i)->sub_push_back(thread_idx, particle_id);
+bool Grid::add(int thread_idx, int i, int j, int particle_id) {
+	return (this->p + j * cols + i)->sub_push_back(thread_idx, particle_id);
 }
 void Grid::toVector()
 {
-	if constexpr (CORES > 1)		// make 1 core per task zero cost
+	if (threads > 1)		// make 1 core per task zero cost
 	{
-#pragma omp parallel for num_threads(CORES)
+#pragma omp parallel for num_threads(threads)
 		for (int i = 0; i < size; i++) {
 			p[i].toVector();
 		}
 	}
 }
 void Grid::clear() {
-#pragma omp parallel for num_threads(CORES)
+#pragma omp parallel for num_threads(threads)
 	for (int i = 0; i < size; i++) {
 		p[i].clear();
 	}
 }
 void Grid::gridLocate(float* x, int N) {
 	xyt* particles = (xyt*)(void*)x;
-	int stride = N / CORES;
-#pragma omp parallel num_threads(CORES)
+	int stride = N / threads;
+	bool overflow = false;
+#pragma omp parallel num_threads(threads) reduction(||:overflow)
 	{
 		int idx = omp_get_thread_num();
-		int end = idx + 1 == CORES ? N : (idx + 1) * stride;
+		int end = idx + 1 == threads ? N : (idx + 1) * stride;
 		for (int cnt = idx * stride; cnt < end; cnt++) {
 			int i = xlocate(particles[cnt].x);
 			int j = ylocate(particles[cnt].y);
-			add(idx, i, j, cnt);
+			if (!add(idx, i, j, cnt)) overflow = true;
 		}
 	}
+	if (overflow) {
+		// cannot throw inside the parallel region
+		cout << "A grid cell overflows!" << endl;
+		throw 114514;
+	}
 	this->toVector();
 }
 
-void Grid::collisionDetectPP(float* x, PairInfo* dst) {
+void Grid::collisionDetectPP(float* x, vector<ParticlePair>* dst, float cutoff2) {
 	/*
 		Given that a particle is in a certain grid,
 		it is only possible to collide with particles in that grid or surrounding grids.
+		require: the cell size is not less than sqrt(cutoff2)
 	*/
 	xyt* particles = (xyt*)(void*)x;
 
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(threads)
 	{
 		int idx = omp_get_thread_num();
 		int n_tasks = cols - 2;
-		int start = 1 + idx * (n_tasks / CORES);
-		int end = 1 + (idx + 1) * (n_tasks / CORES);
-		if (idx + 1 == CORES) end = cols - 1;
+		int start = 1 + idx * (n_tasks / threads);
+		int end = 1 + (idx + 1) * (n_tasks / threads);
+		if (idx + 1 == threads) end = cols - 1;
 
 		for (int i = start; i < end; i++)  // begin at the (1,1) cell.
 		{
@@ -116,8 +131,8 @@ void Grid::collisionDetectPP(float* x, PairInfo* dst) {
 										dx = P->x - Q->x,
 										dy = P->y - Q->y,
 										r2 = dx * dx + dy * dy;
-									if (r2 < 4) {
-										dst->info_pp[idx].push_back({ p,q,dx,dy,P->t,Q->t });
+									if (r2 < cutoff2) {
+										dst[idx].push_back({ p,q,dx,dy,P->t,Q->t });
 									}
 								}
 							}
@@ -136,8 +151,8 @@ void Grid::collisionDetectPP(float* x, PairInfo* dst) {
 								dx = P->x - Q->x,
 								dy = P->y - Q->y,
 								r2 = dx * dx + dy * dy;
-							if (r2 < 4) {
-								dst->info_pp[idx].push_back({ p,q,dx,dy,P->t,Q->t });
+							if (r2 < cutoff2) {
+								dst[idx].push_back({ p,q,dx,dy,P->t,Q->t });
 							}
 						}
 					}
@@ -153,7 +168,7 @@ void Grid::boundaryCollisionDetectPW(float* x, int N, PairInfo* dst, EllipseBoun
 	*/
 	xyt* particles = (xyt*)(void*)x;
 
-#pragma omp parallel num_threads(CORES)
+#pragma omp parallel num_threads(threads)
 	{
 		int idx = omp_get_thread_num();
 	#pragma omp for
@@ -168,9 +183,97 @@ void Grid::boundaryCollisionDetectPW(float* x, int N, PairInfo* dst, EllipseBoun
 	}
 }
 
+VerletList::VerletList(int N, int threads, float skin)
+{
+	this->skin = skin;
+	candidates.resize(threads);
+	for (int i = 0; i < threads; i++) {
+		candidates[i].reserve(N * 4 / threads);
+	}
+	q0 = VectorXf::Zero(dof * N);
+	rebuilds = 0;
+	valid = false;
+}
+
+void VerletList::clear()
+{
+	valid = false;
+}
+
+float VerletList::maxDisplacement(State* s)
+{
+	xyt* q = (xyt*)(void*)s->configuration.data();
+	xyt* p = (xyt*)(void*)q0.data();
+	float d2 = 0;
+#pragma omp parallel for num_threads(s->threads) reduction(max:d2)
+	for (int i = 0; i < s->N; i++) {
+		float
+			dx = q[i].x - p[i].x,
+			dy = q[i].y - p[i].y,
+			r2 = dx * dx + dy * dy;
+		if (r2 > d2) d2 = r2;
+	}
+	return sqrtf(d2);
+}
+
+void VerletList::build(State* s)
+{
+	float cutoff = 2 + skin;
+	for (auto& lst : candidates) {
+		lst.clear();
+	}
+	Grid* grid = s->GridLocate();			// the cell size is (2 + skin) in the Verlet mode
+	grid->collisionDetectPP(s->configuration.data(), candidates.data(), cutoff * cutoff);
+	q0 = s->configuration;
+	rebuilds++;
+	valid = true;
+}
+
+void VerletList::refresh(State* s, PairInfo* dst)
+{
+	/*
+		Recalculate the relative positions of candidate pairs, and keep those truly in contact.
+	*/
+	xyt* particles = (xyt*)(void*)s->configuration.data();
+
+#pragma omp parallel num_threads(s->threads)
+	{
+		int idx = omp_get_thread_num();
+		int n = candidates[idx].size();
+		ParticlePair* src = candidates[idx].data();
+		for (int i = 0; i < n; i++) {
+			int
+				p = src[i].id1, q = src[i].id2;
+			xyt*
+				P = particles + p, * Q = particles + q;
+			float
+				dx = P->x - Q->x,
+				dy = P->y - Q->y,
+				r2 = dx * dx + dy * dy;
+			if (r2 < 4) {
+				dst->info_pp[idx].push_back({ p,q,dx,dy,P->t,Q->t });
+			}
+		}
+	}
+}
+
+void VerletList::detect(State* s, PairInfo* dst)
+{
+	if (!valid || maxDisplacement(s) > skin / 2) {
+		build(s);
+	}
+	refresh(s, dst);
+}
+
 void _collisionDetect(State* s, PairInfo* pinfo) {
 	pinfo->clear();
-	Grid* grid = s->GridLocate();
-	grid->collisionDetectPP(s->configuration.data(), pinfo);
-	grid->boundaryCollisionDetectPW(s->configuration.data(), s->N, pinfo, s->boundary);
+	if (s->verlet == NULL) {
+		Grid* grid = s->GridLocate();
+		grid->collisionDetectPP(s->configuration.data(), pinfo->info_pp.data(), 4);
+	}
+	else {
+		s->verlet->detect(s, pinfo);
+	}
+	// boundary collision detection does not depend on the cell list
+	s->grid.obj->boundaryCollisionDetectPW(s->configuration.data(), s->N, pinfo, s->boundary);
 }
@@ -9,11 +9,13 @@ struct State;
 struct EllipseBoundary;
 
 const int grid_single_capacity = 16;
+const float max_verlet_skin = 1.0f;		// the cell size is 2 + skin, so a larger skin overflows cells
 
 void _collisionDetect(State* s, PairInfo* pinfo);
 
 struct Grid {
-    VectorList<int, CORES, grid_single_capacity>* p;
+    VectorList<int, grid_single_capacity>* p;
+	int threads;
 	float a;									// the "lattice constant" of the grid
 	int m, n;									// number of efficient cells of a half axis
 	int xshift, yshift;							// number of cells of a half axis
@@ -24,17 +26,38 @@ struct Grid {
 	int* collision_detect_region;				// only 5 cells (including self) are taken into account 
 												// in the collision detection of a cell.
 
-	Grid();
+	Grid(int threads);
+	~Grid();
 	void init(float cell_size, float boundary_a, float boundary_b);
 	void gridLocate(float* px, int N);
 
 	int xlocate(float x);
 	int ylocate(float y);
-	VectorList<int, CORES, grid_single_capacity>* loc(int i, int j);
-	void add(int thread_idx, int i, int j, int particle_id);
+	VectorList<int, grid_single_capacity>* loc(int i, int j);
+	bool add(int thread_idx, int i, int j, int particle_id);
 	void toVector();
 	void clear();
 
-	void collisionDetectPP(float* x, PairInfo* dst);
+	void collisionDetectPP(float* x, vector<ParticlePair>* dst, float cutoff2);
 	void boundaryCollisionDetectPW(float* x, int N, PairInfo* dst, EllipseBoundary* b);
+};
+
+/*
+	Verlet neighbor list: candidate pairs are collected with an enlarged cutoff (2 + skin),
+	and only rebuilt when some particle has moved more than skin / 2 since the last build.
+	Between two builds, only the geometry of the candidate pairs is refreshed.
+*/
+struct VerletList {
+	vector<vector<ParticlePair>> candidates;	// one list per thread
+	VectorXf q0;								// the configuration at the last build
+	float skin;
+	int rebuilds;								// number of builds since the last reset
+	bool valid;
+
+	VerletList(int N, int threads, float skin);
+	void clear();
+	float maxDisplacement(State* s);
+	void build(State* s);
+	void refresh(State* s, PairInfo* dst);
+	void detect(State* s, PairInfo* dst);
 };
\ No newline at end of file
@@ -4,6 +4,15 @@
 #include <iostream>
 #include <fstream>
 
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#endif
+
 template<typename ty>
 void writeArrayToFile(ty* ptr, size_t size, const std::string& filename) {
     std::ofstream file(filename, std::ios::binary);
@@ -26,4 +35,52 @@ void readArrayFromFile(ty* ptr, size_t size, const std::string& filename) {
     else {
         std::cout << "Unable to open file" << std::endl;
     }
+}
+
+/*
+    Map a file into memory as read-only. Processes mapping the same file share one copy in the page cache.
+    Return: NULL if the mapping fails or the size of the file is not `bytes`
+*/
+inline void* mapFileReadonly(const std::string& filename, size_t bytes) {
+#ifdef _WIN32
+    HANDLE file = CreateFileA(filename.c_str(), GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (file == INVALID_HANDLE_VALUE) {
+        std::cout << "Unable to open file" << std::endl;
+        return NULL;
+    }
+    LARGE_INTEGER size;
+    if (!GetFileSizeEx(file, &size) || (size_t)size.QuadPart != bytes) {
+        std::cout << "Unexpected file size" << std::endl;
+        CloseHandle(file);
+        return NULL;
+    }
+    HANDLE mapping = CreateFileMappingA(file, NULL, PAGE_READONLY, 0, 0, NULL);
+    CloseHandle(file);
+    if (mapping == NULL) {
+        std::cout << "Unable to map file" << std::endl;
+        return NULL;
+    }
+    void* ptr = MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0);
+    CloseHandle(mapping);           // the view keeps the mapping alive
+    return ptr;
+#else
+    int fd = open(filename.c_str(), O_RDONLY);
+    if (fd == -1) {
+        std::cout << "Unable to open file" << std::endl;
+        return NULL;
+    }
+    struct stat st;
+    if (fstat(fd, &st) == -1 || (size_t)st.st_size != bytes) {
+        std::cout << "Unexpected file size" << std::endl;
+        close(fd);
+        return NULL;
+    }
+    void* ptr = mmap(NULL, bytes, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);                      // the mapping keeps the file alive
+    if (ptr == MAP_FAILED) {
+        std::cout << "Unable to map file" << std::endl;
+        return NULL;
+    }
+    return ptr;
+#endif
 }
\ No newline at end of file
@@ -1,5 +1,6 @@
 #include "pch.h"
 #include "optimizer.h"
+#include "gradient.h"
 #include <random>
 
 float maxGradientAbs(VectorXf& g) {
@@ -30,35 +31,12 @@ VectorXf normalize(const VectorXf& g) {
     return g;
 }
 
+void normalizeInPlace(VectorXf& g) {
+    float norm_g = g.norm();
+    if (norm_g > 0) g /= norm_g;
+}
 
 
-/*
-    Reuse state loaders to prevent memory leakage.
-*/
-struct StateLoaderManager
-{
-    vector<StateLoader*> lst;
-
-    StateLoader* loader(State* s) {
-        if (s->sibling_id < lst.size()) {
-            if (lst[s->sibling_id] == NULL) {
-                lst[s->sibling_id] = new StateLoader(s);
-                return lst[s->sibling_id];
-            }
-            else {
-                return lst[s->sibling_id]->redefine(s);
-            }
-        }
-        else {
-            int n = lst.size();
-            int m = s->sibling_id + 1;
-            lst.resize(m);
-            memset(lst.data() + n, 0, (m - n) * sizeof(StateLoader*));
-            lst[s->sibling_id] = new StateLoader(s);
-            return lst[s->sibling_id];
-        }
-    }
-};
 
 static VectorXf polyFit(VectorXf& x, VectorXf& y, int deg) {
     MatrixXf mtxVandermonde(x.size(), deg + 1); // Vandermonde matrix of X-axis coordinate vector of sample data
@@ -86,12 +64,11 @@ static VectorXf polyFit(VectorXf& x, VectorXf& y, int deg) {
 */
 static std::pair<VectorXf, VectorXf> landscape(State* s, VectorXf& g, float max_stepsize, int samples)
 {
-    static StateLoaderManager slm;
     VectorXf xs(samples), ys(samples);
     std::default_random_engine generator;
     std::normal_distribution<float> distribution(max_stepsize / 2, max_stepsize / 2);
 
-    StateLoader* s_temp = slm.loader(s);
+    StateLoader* s_temp = s->scratchLoader();
     int cnt = 0;
     int max_attemps = 5;
     bool flag = false;
@@ -141,8 +118,7 @@ static float minimizeCubic(float a, float b, float c, float sc) {
 */
 float ERoot(State* s, VectorXf& g, float expected_stepsize) 
 {
-    static StateLoaderManager slm;
-    StateLoader* sl = slm.loader(s);
+    StateLoader* sl = s->scratchLoader();
     float s1 = expected_stepsize;
     float e_ref = s->CalEnergy();
     float e0 = sl->setDescent(s1, g)->CalEnergy() - e_ref;
@@ -176,12 +152,19 @@ StateLoader::StateLoader(State* s)
     s_ref = s;
     s_temp = new State(s->N);
     s_temp->boundary = s->boundary;
+    s_temp->setThreads(s->threads);
+}
+
+StateLoader::~StateLoader()
+{
+    delete s_temp;
 }
 
 StateLoader* StateLoader::redefine(State* s)
 {
     s_ref = s;
     s_temp->boundary = s_ref->boundary;
+    s_temp->setThreads(s_ref->threads);
     return this;
 }
 
@@ -197,3 +180,68 @@ State* StateLoader::setDescent(float a, VectorXf& g)
     s_temp->descent(a, g);
     return s_temp;
 }
+
+/*
+    FIRE: inertial relaxation with an adaptive time step, with the half step back of FIRE 2.0.
+    Every degree of freedom has unit mass. Parameters are `s->fire`.
+    Criteria are those of `State::equilibrium` with `s->optimizer`, and `ge` is used as energy records.
+*/
+float FIRE(State* s, int max_iterations, float min_energy_slope)
+{
+    const FireParams& p = s->fire;
+    const OptimizerParams& criteria = s->optimizer;
+    const int energy_stride = criteria.energy_stride;
+    VectorXf v = VectorXf::Zero(s->configuration.size());
+    VectorXf F(s->configuration.size());
+    float dt = p.dt, alpha = p.alpha_start;
+    float current_min_energy = s->CalEnergy();
+    int n_positive = 0, turns_of_criterion = 0;
+
+    for (int i = 0; i < max_iterations; i++)
+    {
+        s->iterations++;
+        s->CalGradientInto<Normal>(F);
+        F = -F;
+        // gradient criterion
+        if (maxGradientAbs(F) < criteria.max_gradient) break;
+
+        if (F.dot(v) > 0) {
+            n_positive++;
+            if (n_positive > p.n_min) {
+                dt = std::min(dt * p.f_inc, p.dt_max);
+                alpha *= p.f_alpha;
+            }
+        }
+        else {
+            n_positive = 0;
+            dt *= p.f_dec;
+            alpha = p.alpha_start;
+            s->descent(0.5f * dt, v);   // half a step back
+            v.setZero();
+        }
+        // semi-implicit Euler, and mixing the velocity towards the force
+        v += dt * F;
+        float F_norm = F.norm();
+        if (F_norm > 0) v = (1 - alpha) * v + (alpha * v.norm() / F_norm) * F;
+        float max_dx = dt * maxGradientAbs(v);
+        s->descent(max_dx > p.max_step ? -p.max_step / max_dx * dt : -dt, v);
+
+        // other criteria
+        if ((i + 1) % energy_stride == 0) {
+            float E = s->CalEnergy();
+            s->ge.push_back(E);
+            // energy criterion
+            if (E < criteria.min_energy) break;
+            // descent speed criterion
+            if (abs(1 - E / current_min_energy) < min_energy_slope) {
+                turns_of_criterion++;
+                if (turns_of_criterion >= 10) break;
+            }
+            // moving average
+            if (E < current_min_energy) {
+                current_min_energy = (current_min_energy + E) / 2;
+            }
+        }
+    }
+    return s->CalEnergy();
+}
@@ -11,42 +11,59 @@ float maxGradientAbs(VectorXf& g);
 */
 float Modify(VectorXf& g);
 VectorXf normalize(const VectorXf& g);
+void normalizeInPlace(VectorXf& g);
 
 float ERoot(State* s, VectorXf& g, float expected_stepsize);
 float BestStepSize(State* s, VectorXf& g, float max_stepsize);
+float FIRE(State* s, int max_iterations, float min_energy_slope);
 
 struct StateLoader {
     State* s_ref;
     State* s_temp;
 
     StateLoader(State* s);
+    ~StateLoader();
     StateLoader* redefine(State* s);
     State* clear();
     State* setDescent(float a, VectorXf& g);
 };
 
-template<int m>
+/*
+    m: the history depth, which determines the precision of the inverse Hessian.
+    History vectors are allocated once, and reused in turn by DynamicRollList.
+    Only the last two x and g are used. q is the workspace of CalDirection.
+*/
 struct L_bfgs {
-    RollList<VectorXf, m> x, g, s, y;
-    RollList<float, m> a, b, rho;
+    int m;
+    DynamicRollList<VectorXf> x, g, s, y;
+    DynamicRollList<float> a, b, rho;
+    VectorXf q;
 
-    L_bfgs(State* state) { init(state); }
+    L_bfgs(State* state, int m) : m(m) { init(state); }
     void init(State* s);
     void update(State* state, int k);
-    VectorXf CalDirection(State* s, int k);
+    void CalDirection(State* s, int k, VectorXf& z);
 };
 
-template<int m>
-inline void L_bfgs<m>::init(State* state)
+inline void L_bfgs::init(State* state)
 {
     const float a0 = 1e-4f;     // initial step size
+    int n = state->configuration.size();
+    x.resize(2); g.resize(2);
+    s.resize(m); y.resize(m); a.resize(m); b.resize(m); rho.resize(m);
+    for (int i = 0; i < 2; i++) {
+        x[i].resize(n); g[i].resize(n);
+    }
+    for (int i = 0; i < m; i++) {
+        s[i].resize(n); y[i].resize(n);
+    }
+    q.resize(n);
     a[0] = a0;
     x[0] = state->configuration;
-    g[0] = state->CalGradient<Normal>();
+    state->CalGradientInto<Normal>(g[0]);
 }
 
-template<int m>
-inline void L_bfgs<m>::update(State* state, int k)
+inline void L_bfgs::update(State* state, int k)
 {
     /*
         Readonly: do not change the state in this function!
@@ -54,31 +71,32 @@ inline void L_bfgs<m>::update(State* state, int k)
     const float e = 1e-6f;  // to avoid the denominator being zero
     x[k + 1] = state->configuration;
     s[k] = x[k + 1] - x[k];
-    g[k + 1] = state->CalGradient<Normal>();
+    state->CalGradientInto<Normal>(g[k + 1]);
     y[k] = g[k + 1] - g[k];
     rho[k] = 1.0f / (y[k].dot(s[k]) + e);
 }
 
-template<int m>
-inline VectorXf L_bfgs<m>::CalDirection(State* state, int k)
+inline void L_bfgs::CalDirection(State* state, int k, VectorXf& z)
 {
+    /*
+        z: the descent direction, a preallocated vector
+    */
     const float e = 1e-6f;  // to avoid the denominator being zero
     if (k < m) {
-        return normalize(state->CalGradient<Normal>());
+        state->CalGradientInto<Normal>(z);
+        normalizeInPlace(z);
     }
     else {
-        // solve for the descent direction: z
-        VectorXf q = state->CalGradient<Normal>();
+        state->CalGradientInto<Normal>(q);
         for (int i = k - 1; i >= k - m; i--) {
             a[i] = rho[i] * s[i].dot(q);
             q -= a[i] * y[i];
         }
-        VectorXf z = (s[k - 1].dot(y[k - 1]) / (y[k - 1].dot(y[k - 1]) + e)) * q;
+        z = (s[k - 1].dot(y[k - 1]) / (y[k - 1].dot(y[k - 1]) + e)) * q;
         for (int i = k - m; i <= k - 1; i++) {
             b[i] = rho[i] * y[i].dot(z);
             z += (a[i] - b[i]) * s[i];
         }
-        return z;
     }
 }
 
@@ -86,31 +104,32 @@ template<bool enable_line_search, bool enable_lbfgs>
 inline float State::equilibrium(int max_iterations, float min_energy_slope)
 {
     /*
-        use `ge` as max gradient energies
+        use `ge` as max gradient energies. Parameters are `optimizer`.
     */
+    const OptimizerParams& p = optimizer;
     float current_min_energy = CalEnergy();
-    float step_size = enable_lbfgs ? 5e-3 : 1e-3;
+    float step_size = enable_lbfgs ? p.step_size_lbfgs : p.step_size;
     int turns_of_criterion = 0;
 
-    const int m = 4;					// determine the precision of the inverse Hessian
-    L_bfgs<m>* lbfgs = NULL;
-    if constexpr (enable_lbfgs)lbfgs = new L_bfgs<m>(this);
+    L_bfgs* lbfgs = NULL;
+    if constexpr (enable_lbfgs)lbfgs = new L_bfgs(this, p.lbfgs_m);
 
-    int energy_stride = (enable_line_search || enable_lbfgs) ? 10 : 1000;
+    int energy_stride = (enable_line_search || enable_lbfgs) ? p.energy_stride : p.energy_stride_gd;
+    VectorXf g(configuration.size());   // workspace of the direction of descent
 
     for (int i = 0; i < max_iterations; i++)
     {
-        VectorXf g;
+        iterations++;
         // calculate the direction of descent
         if constexpr (enable_lbfgs) {
-            g = lbfgs->CalDirection(this, i);
+            lbfgs->CalDirection(this, i, g);
         }
         else {
-            g = CalGradient<Normal>();
+            CalGradientInto<Normal>(g);
         }
         float gm = Modify(g);
         // gradient criterion
-        if (gm < 1e-2) break;
+        if (gm < p.max_gradient) break;
 
         // calculate the step size
         if constexpr (enable_line_search) {
@@ -130,7 +149,7 @@ inline float State::equilibrium(int max_iterations, float min_energy_slope)
             float E = CalEnergy();
             ge.push_back(E);
             // energy criterion
-            if (E < 1e-3) {
+            if (E < p.min_energy) {
                 break;
             }
             // step size (descent speed) criterion
@@ -142,9 +161,9 @@ inline float State::equilibrium(int max_iterations, float min_energy_slope)
                 else {
                     turns_of_criterion++;
                     if (turns_of_criterion >= 4) {
-                        step_size *= 0.6;
+                        step_size *= p.step_decay;
                         turns_of_criterion = 0;
-                        if (step_size < 1e-4)break;
+                        if (step_size < p.min_step_size)break;
                     }
                 }
             }
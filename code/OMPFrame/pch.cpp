@@ -26,6 +26,9 @@ State* Global::newState(int N)
         delete states[id];
         states[id] = new State(N);
     }
+    else {
+        states[id]->resetSettings();
+    }
     return states[id];
 }
 
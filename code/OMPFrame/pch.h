@@ -27,11 +27,21 @@ DLLEXPORT void setRod(int n, float d, int threads);
 DLLEXPORT void* createState(int N, float boundary_a, float boundary_b);
 DLLEXPORT void initStateAsDisks(void* state_ptr);
 DLLEXPORT void setBoundary(void* state_ptr, float boundary_a, float boundary_b);
+DLLEXPORT void setThreads(void* state_ptr, int threads);
+DLLEXPORT void setVerletSkin(void* state_ptr, float skin);
 DLLEXPORT void singleStep(void* state_ptr, int mode, float step_size);
 DLLEXPORT float equilibriumGD(void* state_ptr, int max_iterations);
 DLLEXPORT float eqLineGD(void* state_ptr, int max_iterations);
 DLLEXPORT float eqLBFGS(void* state_ptr, int max_iterations);
 DLLEXPORT float eqMix(void* state_ptr, int max_iterations);
+DLLEXPORT float eqFIRE(void* state_ptr, int max_iterations);
+DLLEXPORT void setOptimizerParams(void* state_ptr, int lbfgs_m, double max_gradient, double min_energy,
+    int energy_stride, int energy_stride_gd, double step_size, double step_size_lbfgs, double step_decay,
+    double min_step_size);
+DLLEXPORT void setFireParams(void* state_ptr, float dt, float dt_max, float max_step, int n_min,
+    float f_inc, float f_dec, float alpha_start, float f_alpha);
+DLLEXPORT void equilibriumBatch(void** state_ptrs, int n_states, int method, int* max_iterations, int threads,
+    float* energies, int* iterations);
 
 // fetching data
 DLLEXPORT void* getStateData(void* state_ptr);
@@ -40,6 +50,10 @@ DLLEXPORT void* getStateMaxGradOrEnergy(void* state_ptr);
 DLLEXPORT void* getStateResidualForce(void* state_ptr);
 DLLEXPORT float getStateMaxResidualForce(void* state_ptr);
 DLLEXPORT int getSiblingId(void* state_ptr);
+DLLEXPORT int getCores();
+DLLEXPORT int getStateRebuilds(void* state_ptr);
+DLLEXPORT int getStateGradientEvaluations(void* state_ptr);
+DLLEXPORT int getStateEnergyEvaluations(void* state_ptr);
 
 // load data
 DLLEXPORT void setStateData(void* state_ptr, void* data_src);
@@ -49,8 +63,11 @@ DLLEXPORT void renewState(void* state_ptr);
 
 // built-in IO
 DLLEXPORT void readPotential(int n, float d);
+DLLEXPORT void readPotentialFrom(int n, float d, const char* filename, bool use_mmap);
 DLLEXPORT void writePotential();
+DLLEXPORT void writePotentialTo(const char* filename);
 DLLEXPORT int getPotentialId();
+DLLEXPORT unsigned long long potentialChecksum();
 
 // analysis
 DLLEXPORT float* landscapeAlongGradient(void* state_ptr, float max_stepsize, int samples);
@@ -62,6 +79,9 @@ DLLEXPORT float meanS(void* state_ptr, float gamma);
 DLLEXPORT float absPhi(void* state_ptr, float gamma, int p);
 DLLEXPORT float* Si(void* state_ptr, float gamma);
 DLLEXPORT float* neighborAngleDist(void* state_ptr, float gamma, int bins);
+DLLEXPORT void observables(void* state_ptr, float gamma, int* props, int n_props, float* dst);
+DLLEXPORT void observablesBatch(float* frames, float* boundaries, int n_frames, int N, float gamma,
+    int* props, int n_props, int threads, float* dst);
 
 // test of algorithms
 DLLEXPORT float fastPotential(float x, float y, float t);
@@ -14,11 +14,27 @@ State::State(int N)
 {
 	this->N = N;
 	this->sibling_id = 255;  // default: only for test functions
+	this->threads = CORES;
+	this->iterations = 0;
+	this->gradient_evaluations = 0;
+	this->energy_evaluations = 0;
 	boundary = NULL;
 	configuration = VectorXf::Zero(dof * N);
-	grid = Maybe<Grid*>(new Grid());
-	pair_info = Maybe<PairInfo*>(new PairInfo(N));
+	grid = Maybe<Grid*>(new Grid(threads));
+	pair_info = Maybe<PairInfo*>(new PairInfo(N, threads));
 	voronoi = Maybe<Graph<neighbors>*>(new Graph<neighbors>(N));
+	verlet = NULL;
+	loader = NULL;
+}
+
+State::~State()
+{
+	// the boundary may be shared with state loaders, so it is not deleted here
+	delete grid.obj;
+	delete pair_info.obj;
+	delete voronoi.obj;
+	delete verlet;
+	delete loader;
 }
 
 State::State(int N, int sibling) : State(N)
@@ -53,6 +69,7 @@ void State::randomInitStateCC()
 	std::mt19937 gen(rd());
 	std::uniform_real_distribution<float> dist(0.0, 1.0);  
 	clearCache();
+	if (verlet != NULL) verlet->clear();
 
 	float a = boundary->a - 1;
 	float b = boundary->b - 1;
@@ -102,6 +119,48 @@ void State::setBoundary(float a, float b)
 	clearCache();
 }
 
+/*
+	Reallocate all per-thread buffers if the number of threads is changed.
+*/
+void State::setThreads(int threads)
+{
+	if (threads < 1 || threads == this->threads) return;
+	this->threads = threads;
+	delete grid.obj;
+	delete pair_info.obj;
+	grid = Maybe<Grid*>(new Grid(threads));
+	pair_info = Maybe<PairInfo*>(new PairInfo(N, threads));
+	if (verlet != NULL) {
+		setVerletSkin(verlet->skin);
+	}
+	clearCache();
+}
+
+/*
+	skin > 0: enable the Verlet neighbor list; skin <= 0: disable it.
+	A small skin (~0.5) is recommended, for the capacity of a grid cell is limited.
+	The skin is clamped to max_verlet_skin.
+*/
+void State::setVerletSkin(float skin)
+{
+	if (verlet != NULL) {
+		delete verlet; verlet = NULL;
+	}
+	if (skin > max_verlet_skin) {
+		cout << "Verlet skin " << skin << " is clamped to " << max_verlet_skin << endl;
+		skin = max_verlet_skin;
+	}
+	if (skin > 0) {
+		verlet = new VerletList(N, threads, skin);
+	}
+	clearCache();
+}
+
+int State::verletRebuilds()
+{
+	return verlet == NULL ? 0 : verlet->rebuilds;
+}
+
 void State::descent(float a, VectorXf& g)
 {
 	configuration -= a * g;
@@ -116,6 +175,7 @@ void State::loadFromData(float* data_src)
 	*/
 	memcpy(configuration.data(), data_src, dof * N * sizeof(float));
 	clearCache();
+	if (verlet != NULL) verlet->clear();
 }
 
 bool outside(xyt& q, float Xmax, float Ymax) {
@@ -135,7 +195,7 @@ void State::crashIfDataInvalid()
 		a1 = boundary->a + 1,
 		b1 = boundary->b + 1;
 
-#pragma omp parallel for
+#pragma omp parallel for num_threads(threads)
 	for (int i = 0; i < N; i++) {
 #if ENABLE_NAN_CHECK
 		if (isnan(ptr[i]) || isinf(ptr[i])) {
@@ -158,33 +218,76 @@ void State::crashIfDataInvalid()
 #endif
 }
 
-float State::eqMix(int max_iterations)
+/*
+	Each state owns its scratch state, so that line searches of states relaxed concurrently
+	(see `equilibriumBatch`) do not share one.
+*/
+StateLoader* State::scratchLoader()
+{
+	if (loader == NULL) {
+		loader = new StateLoader(this);
+		return loader;
+	}
+	return loader->redefine(this);
+}
+
+/*
+	restore the default settings, when a state in the pool is handed out again
+*/
+void State::resetSettings()
+{
+	setThreads(CORES);
+	setVerletSkin(0);
+	optimizer = OptimizerParams();
+	fire = FireParams();
+}
+
+/*
+	clear records of the last equilibrium
+*/
+void State::resetRecords()
 {
 	ge.clear();
+	iterations = 0;
+	gradient_evaluations = 0;
+	energy_evaluations = 0;
+	if (verlet != NULL) verlet->rebuilds = 0;
+}
+
+float State::eqMix(int max_iterations)
+{
+	resetRecords();
 	this->template equilibrium<false, true>(max_iterations, 0.4);
 	return this->template equilibrium<false, false>(max_iterations, 1e-3);
 }
 
 float State::equilibriumGD(int max_iterations)
 {
-	ge.clear();
+	resetRecords();
 	return this->template equilibrium<false, false>(max_iterations, 1e-4);
 }
 
 float State::eqLineGD(int max_iterations)
 {
-	ge.clear();
+	resetRecords();
 	return this->template equilibrium<true, false>(max_iterations, 1e-3);
 }
 
 float State::eqLBFGS(int max_iterations)
 {
-	ge.clear();
+	resetRecords();
 	return this->template equilibrium<true, true>(max_iterations, 1e-2);
 }
 
+float State::eqFIRE(int max_iterations)
+{
+	resetRecords();
+	return FIRE(this, max_iterations, 1e-4);
+}
+
 void _gridLocate(State* s, Grid* grid) {
-	grid->init(2, s->boundary->a, s->boundary->b);		// including gird->clear()
+	float cell_size = s->verlet == NULL ? 2 : 2 + s->verlet->skin;
+	grid->init(cell_size, s->boundary->a, s->boundary->b);		// including gird->clear()
 	grid->gridLocate(s->configuration.data(), s->N);
 }
 
@@ -208,21 +311,22 @@ PairInfo* State::CollisionDetect()
 
 float State::CalEnergy()
 {
-	return this->CollisionDetect()->CalEnergy()->sum();
+	PairInfo* pair_info = this->CollisionDetect();
+	if (!pair_info->e_buffer.valid) energy_evaluations++;
+	return pair_info->CalEnergy()->sum();
 }
 
 VectorXf State::LbfgsDirection(int iterations)
 {
-	const int m = 4;					// determine the precision of the inverse Hessian
 	const float step_size = 1e-3;
-	L_bfgs<m> lbfgs(this);
+	L_bfgs lbfgs(this, optimizer.lbfgs_m);
 	StateLoader sl(this); sl.clear();
 
-	VectorXf d(N);
+	VectorXf d(dof * N);
 	for (int i = 0; i < iterations; i++) {
-		d = lbfgs.CalDirection(sl.s_temp, i);
+		lbfgs.CalDirection(sl.s_temp, i, d);
 		lbfgs.update(sl.setDescent(step_size, d), i);
 	}
-	d = lbfgs.CalDirection(sl.s_temp, iterations);
+	lbfgs.CalDirection(sl.s_temp, iterations, d);
 	return d;
 }
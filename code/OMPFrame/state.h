@@ -5,6 +5,8 @@
 
 struct Grid; 
 struct PairInfo;
+struct VerletList;
+struct StateLoader;
 
 struct EllipseBoundary {
     float a, b;
@@ -19,17 +21,55 @@ struct EllipseBoundary {
     Maybe<ParticlePair> collide(int id, const xyt& particle);
 };
 
+/*
+    parameters of FIRE, see `State::eqFIRE`
+*/
+struct FireParams {
+    float dt = 1e-3f;               // initial time step
+    float dt_max = 1e-2f;
+    float max_step = 0.1f;          // maximum displacement of a degree of freedom in one step
+    int n_min = 5;                  // steps of positive power before the time step increases
+    float f_inc = 1.1f;
+    float f_dec = 0.5f;
+    float alpha_start = 0.1f;
+    float f_alpha = 0.99f;
+};
+
+/*
+    parameters of `State::equilibrium`, in double as the constants they replace
+*/
+struct OptimizerParams {
+    int lbfgs_m = 4;                // history depth of L-BFGS
+    double max_gradient = 1e-2;     // gradient criterion: the max amplitude of the gradient of a particle
+    double min_energy = 1e-3;       // energy criterion
+    int energy_stride = 10;         // iterations between energy checks, with line search or L-BFGS
+    int energy_stride_gd = 1000;    // iterations between energy checks, for the fixed step gradient descent
+    double step_size = 1e-3;        // initial step size of gradient descent
+    double step_size_lbfgs = 5e-3;
+    double step_decay = 0.6;        // decay of the step size when the energy stops decreasing
+    double min_step_size = 1e-4;
+};
+
 struct State{
     VectorXf configuration;
     EllipseBoundary* boundary;
     vector<float> ge;               // ge can be either a) max gradient amplitudes, or b) energy records.
+    vector<float> results;          // arrays returned to python. Each state owns one, for concurrent queries.
 
     int N;
     int sibling_id;
+    int threads;                    // number of OpenMP threads used by this state
+    int iterations;                 // number of iterations of the last equilibrium
+    int gradient_evaluations;       // numbers of gradient and energy evaluations of the last equilibrium
+    int energy_evaluations;
+    OptimizerParams optimizer;
+    FireParams fire;
 
     Maybe<Grid*> grid;
     Maybe<PairInfo*> pair_info;
     Maybe<Graph<neighbors>*> voronoi;
+    VerletList* verlet;             // NULL if the Verlet neighbor list is disabled
+    StateLoader* loader;            // scratch state of line searches, created on demand
 
     // methods
 
@@ -37,11 +77,18 @@ struct State{
     State(int N, int sibling);
     State(int N, int sibling, EllipseBoundary* b);
     State(int N, int sibling, EllipseBoundary* b, VectorXf q);
+    ~State();
     void clearCache();
     void randomInitStateCC();
     float initAsDisks(int max_iterations);
+    void resetRecords();
+    void resetSettings();
+    StateLoader* scratchLoader();
 
     void setBoundary(float a, float b);
+    void setThreads(int threads);
+    void setVerletSkin(float skin);
+    int verletRebuilds();
     void descent(float a, VectorXf& g);
     void loadFromData(float* data_src);
     void crashIfDataInvalid();
@@ -49,6 +96,7 @@ struct State{
     float eqLineGD(int max_iterations);
     float eqLBFGS(int max_iterations);
     float eqMix(int max_iterations);
+    float eqFIRE(int max_iterations);
 
     Grid* GridLocate();
     PairInfo* CollisionDetect();
@@ -62,9 +110,12 @@ struct State{
     VectorXf orderS(float gamma);
     float orderS_ave(float gamma);
     VectorXf neighborAngleDist(float gamma, int bins);
+    int observableSize(int prop);
+    void observables(float gamma, const int* props, int n_props, float* dst);
 
     VectorXf LbfgsDirection(int iterations);
     template<HowToCalGradient how> VectorXf CalGradient();
+    template<HowToCalGradient how> void CalGradientInto(VectorXf& dst);
     template<bool enable_line_search, bool enable_lbfgs> float equilibrium(int max_iterations, float min_energy_slope);
 };
 
@@ -138,3 +138,35 @@ VectorXf State::neighborAngleDist(float gamma, int bins)
 	cout << "ckpt 3" << endl;
 	return res.cast<float>() / N;
 }
+
+
+int State::observableSize(int prop)
+{
+	return prop == ObSi ? N : 1;
+}
+
+/*
+	Write several observables to `dst` one after another, each taking `observableSize` floats.
+	The collision detection, the Delaunay triangulation and the order parameter S are computed once for all.
+*/
+void State::observables(float gamma, const int* props, int n_props, float* dst)
+{
+	Maybe<VectorXf> S;
+	for (int k = 0; k < n_props; k++) {
+		switch (props[k]) {
+		case ObMeanDistance: *dst = meanDistance(gamma); break;
+		case ObMeanZ: *dst = meanContactZ(gamma); break;
+		case ObPhi4: *dst = std::abs(orderPhi_ave(gamma, 4)); break;
+		case ObPhi6: *dst = std::abs(orderPhi_ave(gamma, 6)); break;
+		case ObMeanS: case ObSi:
+			if (!S.valid) {
+				S.valid = true;
+				S.obj = orderS(gamma);
+			}
+			if (props[k] == ObMeanS) *dst = S.obj.mean();
+			else memcpy(dst, S.obj.data(), N * sizeof(float));
+			break;
+		}
+		dst += observableSize(props[k]);
+	}
+}
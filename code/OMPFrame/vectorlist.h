@@ -3,19 +3,32 @@
 #include<vector>
 using namespace std;
 
-template<typename ty, int nodes, int max_single_capacity>
+template<typename ty, int max_single_capacity>
 struct VectorList
 {
     ty* data;
-    int ns[nodes];
+    int* ns;
+    int nodes;
 
     VectorList() {
+        data = NULL; ns = NULL; nodes = 0;
+    }
+    ~VectorList() {
+        free(data); free(ns);
+    }
+    void init(int nodes) {
+        this->nodes = nodes;
         data = (ty*)malloc(nodes * max_single_capacity * sizeof(ty));
-        memset(ns, 0, nodes * sizeof(int));
+        ns = (int*)calloc(nodes, sizeof(int));
     }
-    void sub_push_back(int i, const ty& obj) {
+    /*
+        returns false if the i-th sub list is full, in which case obj is not added
+    */
+    bool sub_push_back(int i, const ty& obj) {
+        if (ns[i] == max_single_capacity) return false;
         data[i * max_single_capacity + ns[i]] = obj;
         ns[i]++;
+        return true;
     }
     void clear() {
         memset(ns, 0, nodes * sizeof(int));
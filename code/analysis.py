@@ -160,7 +160,8 @@ class RenderPipe:
 class InteractiveViewer:
     def __init__(self, dataset: DataSet, pipe: RenderPipe, *args):
         self.metadata = dataset.metadata
-        self.data = list(map(lambda x: StateRenderer(x, *args), dataset.data))
+        self.data = dataset.data  # frames are loaded when they are shown
+        self.render_args = args
         self.index = 0
         self.fig = plt.figure()
         self.ax = self.fig.add_subplot(111)
@@ -194,8 +195,9 @@ class InteractiveViewer:
 
     def redraw(self):
         self.clear()
-        self.data[self.index].drawBoundary(self.handle)
-        self.data[self.index].drawParticles(self.handle, self.pipe.eval(self.data[self.index]))
+        renderer = StateRenderer(self.data[self.index], *self.render_args)
+        renderer.drawBoundary(self.handle)
+        renderer.drawParticles(self.handle, self.pipe.eval(renderer))
         plt.draw()
 
     def show(self):
@@ -1,9 +1,13 @@
 import glob
+import json
+import multiprocessing
 import os
 import random
 import string
+import sys
 import threading
 from multiprocessing import Process
+from multiprocessing.connection import wait
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -32,15 +36,20 @@ def randomString():
     return _random_string_generator.generate()
 
 
-def collectResultFiles():
+sibling_manifest = 'siblings.json'
+result_patterns = ['*.h5', '*.log.txt']
+checkpoint_patterns = ['*.checkpoint.npz', sibling_manifest]
+
+
+def collectResultFiles(patterns=None):
     files = []
-    for pattern in ['*.h5', '*.log.txt']:
+    for pattern in patterns or result_patterns:
         files.extend(glob.glob(pattern))
     return [os.path.abspath(file) for file in files]
 
 
 def clearResults():
-    return any([os.remove(f) for f in collectResultFiles()])
+    return any([os.remove(f) for f in collectResultFiles(result_patterns + checkpoint_patterns)])
 
 
 def packResults(archive_name: str):
@@ -55,16 +64,25 @@ class TaskHandle(simu.Simulator):
         super().__init__(N, n, d, boundary_a, boundary_b, potential_name)
 
     @classmethod
-    def fromCircDensity(cls, N, n, d, fraction_as_disks, initial_boundary_aspect, potential_name: str, data_name: str):
+    def fromCircDensity(cls, N, n, d, fraction_as_disks, initial_boundary_aspect, potential_name: str, data_name: str,
+                        threads=None, checkpoint_interval=10, resume=False, adaptive_compression=False):
+        """
+        resume: keep the log and the data of `data_name`, so that the task can continue from its checkpoint
+        adaptive_compression: adapt the compression rate to the relaxations, see `simu.AdaptiveScheduler`
+        """
         obj = cls._fromCircDensity(
-            N, n, d, fraction_as_disks, initial_boundary_aspect, potential_name, data_name)
+            N, n, d, fraction_as_disks, initial_boundary_aspect, potential_name, data_name, threads)
 
         obj.log_file = f'{obj.id}.log.txt'
-        open(obj.log_file, 'w')  # create a log file
+        open(obj.log_file, 'a' if resume else 'w')  # create a log file
+        obj.checkpoint_interval = checkpoint_interval
 
-        q = 1 - 1e-3
-        obj.setBoundaryScheduler(
-            simu.BoundaryScheduler.constant, lambda n, x: x * q ** n)
+        if adaptive_compression:
+            obj.setAdaptiveScheduler(rate=1e-3)
+        else:
+            q = 1 - 1e-3
+            obj.setBoundaryScheduler(
+                simu.Schedule.constant(), simu.Schedule.geometric(q))
         return obj
 
     def getSiblingId(self):
@@ -82,39 +100,107 @@ class TaskHandle(simu.Simulator):
         renderer.drawParticles(handle, s.angle())
         plt.show()
 
+    def start(self):
+        """
+        continue from the checkpoint if there is one, otherwise initialize the particles as disks.
+        The data set keeps the file open in the writer mode, until the task is finished.
+        """
+        self.dataset.openWriter()
+        if self.loadCheckpoint():
+            self.log(f'Resume from step {self.boundary_scheduler.n}, with {self.cnt} frames.')
+        else:
+            self.initAsDisks()
+            self.saveCheckpoint()
+
     def execute(self):
+        """
+        returns: whether the task is finished without exceptions
+        """
         try:
-            self.initAsDisks()
-            for i in range(10000):
+            self.start()
+            for i in range(self.boundary_scheduler.n, 10000):
                 if self.density > 1.0:
                     break
                 self.compress()
                 dt = self.eqMix(4e5)
-                s = self.get()
-                density = self.density
-                its = self.iterationSteps()
-                g = self.maxResidualForce()
-                self.log(
-                    f'i={i}, rho={density}, G={g}, E={s.energy}, nsteps={its}K, speed: {its / dt} Kit/s')
+                if not self.acceptCompression():
+                    continue
+                self.record(dt)
+            return True
         except Exception as e:
             print("An exception occurred!\n", e)
             print(f"In sibling {self.getSiblingId()}, ID: {self.id}")
+            return False
+        finally:
+            self.dataset.closeWriter()
+
+    def record(self, dt):
+        """
+        save the current state and log the current compression step, which takes `dt` seconds.
+        Save a checkpoint every `checkpoint_interval` steps.
+        """
+        i = self.boundary_scheduler.n - 1
+        s = self.get()
+        density = self.density
+        its = self.iterationSteps()
+        rebuilds = self.rebuilds()
+        g = self.maxResidualForce()
+        self.log(
+            f'i={i}, rho={density}, G={g}, E={s.energy}, nsteps={its}K, speed: {its / dt} Kit/s, '
+            f'rebuilds={rebuilds}')
+        if self.boundary_scheduler.n % self.checkpoint_interval == 0:
+            self.saveCheckpoint()
 
 
 class ExperimentsFixedParticleShape:
-    def __init__(self, N, n, d, phi0, potential_name: str, Gammas: np.ndarray, workers=1):
+    def __init__(self, N, n, d, phi0, potential_name: str, Gammas: np.ndarray, workers=1, verlet_skin=0,
+                 potential_cache=None, checkpoint_interval=10, resume=False, adaptive_compression=False):
+        """
+        potential_cache: a directory shared by projects, where potential tables are stored and memory-mapped.
+        checkpoint_interval: number of compression steps between two checkpoints of a sibling.
+        resume: continue the siblings listed in the sibling manifest of the last run, from their checkpoints.
+        adaptive_compression: adapt the compression rate of each sibling to its relaxations.
+        Tasks are built on first use, so that the process pool mode only builds them in worker processes.
+        """
+        if potential_cache is not None:
+            ker.setPotentialCache(potential_cache)
+        self.potential_cache = potential_cache
         self.siblings = len(Gammas)
         self.cores = workers
         self.potential_name = potential_name
-        self.n, self.d = n, d
-        self.tasks = [TaskHandle
-                      .fromCircDensity(N, n, d, phi0, Gamma, potential_name, randomString())
-                      for Gamma in Gammas]
+        self.N, self.n, self.d = N, n, d
+        self.phi0 = phi0
+        self.Gammas = Gammas
+        self.verlet_skin = verlet_skin
+        self.checkpoint_interval = checkpoint_interval
+        self.adaptive_compression = adaptive_compression
+        self.resume = resume and os.path.exists(sibling_manifest)
+        if self.resume:
+            with open(sibling_manifest, 'r') as f:
+                self.ids = json.load(f)
+        else:
+            self.ids = [randomString() for _ in Gammas]
+            with open(sibling_manifest, 'w') as f:
+                json.dump(self.ids, f)
+        self._tasks = None
         self.initPotential()
 
+    @property
+    def tasks(self) -> list[TaskHandle]:
+        if self._tasks is None:
+            self._tasks = [TaskHandle
+                           .fromCircDensity(self.N, self.n, self.d, self.phi0, Gamma, self.potential_name, data_name,
+                                            self.cores, self.checkpoint_interval, self.resume,
+                                            self.adaptive_compression)
+                           for Gamma, data_name in zip(self.Gammas, self.ids)]
+            for task in self._tasks:
+                task.setVerletSkin(self.verlet_skin)
+        return self._tasks
+
     def initPotential(self):
-        # do not save 4GB .dat file
-        self.tasks[0].initPotential(self.siblings * self.cores, save_data=False)
+        # do not save 4GB .dat file, unless it is shared in the potential cache. No kernel state is needed.
+        simu.Simulator(self.N, self.n, self.d, 0, 0, self.potential_name).initPotential(
+            self.siblings * self.cores, save_data=False)
 
     def compress(self):
         return list(map(lambda x: x.compress(), self.tasks))
@@ -128,16 +214,108 @@ class ExperimentsFixedParticleShape:
     def ExperimentAsync(self):
         return list(ut.Map('Release')(executeTask, self.tasks))
 
+    def ExperimentBatch(self):
+        """
+        Compress siblings step by step, and relax all unfinished siblings in one kernel call,
+        so that siblings share `siblings * cores` threads without oversubscription.
+        """
+        threads = self.siblings * self.cores
+        for task in self.tasks:
+            task.setThreads(1)
+        ut.Map('Release')(lambda task: task.start(), self.tasks)
+        active = list(self.tasks)
+        for i in range(10000):
+            active = [task for task in active if task.density <= 1.0]
+            if len(active) == 0:
+                break
+            for task in active:
+                task.compress()
+            dt, _ = simu.equilibriumBatch(active, 'eqMix', 4e5, threads)
+            for task in active:
+                if np.isnan(task.energy_cache):
+                    print("An exception occurred!")
+                    print(f"In sibling {task.getSiblingId()}, ID: {task.id}")
+                elif task.acceptCompression():
+                    task.record(dt)
+            active = [task for task in active if not np.isnan(task.energy_cache)]
+        for task in self.tasks:
+            task.dataset.closeWriter()
+
+    def siblingSpec(self, idx: int) -> dict:
+        """
+        arguments to rebuild the idx-th task in another process
+        """
+        return {
+            'N': self.N, 'n': self.n, 'd': self.d, 'phi0': self.phi0, 'Gamma': self.Gammas[idx],
+            'potential_name': self.potential_name, 'data_name': self.ids[idx], 'threads': self.cores,
+            'verlet_skin': self.verlet_skin, 'potential_cache': self.potential_cache,
+            'checkpoint_interval': self.checkpoint_interval, 'adaptive_compression': self.adaptive_compression,
+        }
+
+    def ExperimentProcessPool(self, retries=3):
+        """
+        Run each sibling in its own process, which loads its own kernel and maps the potential table in the cache,
+        so that a crash in the kernel only kills one sibling. A failed sibling is restarted alone from its last
+        checkpoint (at most `retries` times), while other siblings keep running.
+        Only worker processes build tasks, which create kernel states, data files and logs.
+        returns: IDs of the siblings that still fail after all retries
+        """
+        if self.potential_cache is None:
+            raise ValueError("The process pool mode requires a potential cache shared by processes.")
+        context = multiprocessing.get_context('spawn')  # do not fork a process that holds OpenMP threads
+        attempts = [0] * self.siblings
+        running = {}  # sentinel -> (idx, process)
+
+        def start(idx):
+            attempts[idx] += 1
+            p = context.Process(target=executeSibling, args=(self.siblingSpec(idx),))
+            p.start()
+            running[p.sentinel] = (idx, p)
+
+        for idx in range(self.siblings):
+            start(idx)
+        failed = []
+        while running:
+            for sentinel in wait(list(running.keys())):
+                idx, p = running.pop(sentinel)
+                p.join()
+                if p.exitcode == 0:
+                    continue
+                task_id = self.ids[idx]
+                if attempts[idx] <= retries:
+                    print(f"Sibling {task_id} exited with code {p.exitcode}. Restarting it...")
+                    start(idx)
+                else:
+                    print(f"Sibling {task_id} failed {attempts[idx]} times. Give up.")
+                    failed.append(task_id)
+        return failed
+
 
 def executeTask(task: TaskHandle):
     return task.execute()
 
 
-def main():
+def executeSibling(spec: dict):
+    """
+    entry of a sibling process. See `ExperimentsFixedParticleShape.siblingSpec`.
+    """
+    ker.setPotentialCache(spec['potential_cache'])
+    task = TaskHandle.fromCircDensity(spec['N'], spec['n'], spec['d'], spec['phi0'], spec['Gamma'],
+                                      spec['potential_name'], spec['data_name'], spec['threads'],
+                                      spec['checkpoint_interval'], resume=True,
+                                      adaptive_compression=spec['adaptive_compression'])
+    task.setVerletSkin(spec['verlet_skin'])
+    task.initPotential(spec['threads'], save_data=False)
+    if not task.execute():
+        sys.exit(1)
+
+
+def main(resume=False):
     """
     All process of a simulation, except exception catching and restarting
+    resume: continue the siblings of the last run from their checkpoints
     """
-    CORES = 4     # is FIXED, because it is determined in the DLL (in defs.h)
+    CORES = 4     # threads per sibling
     SIBLINGS = 2  # mutable
 
     with MyThreadRecord('gengjie', CORES * SIBLINGS):
@@ -149,23 +327,30 @@ def main():
             potential_name="ScreenedCoulomb",  # mutable
             Gammas=np.linspace(0.5, 0.8, SIBLINGS, endpoint=True),  # mutable
             workers=CORES,
+            potential_cache='../potential_cache',
+            resume=resume,
         )
-        tasks.ExperimentAsync()
+        failed = tasks.ExperimentProcessPool()
 
+        if failed:
+            # keep the partial data and checkpoints of failed siblings, for inspection or `--resume`
+            print(f"Siblings {failed} failed. Results are not packed.")
+            return
         packResults('results.7z')
 
 
 if __name__ == '__main__':
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    resume = '--resume' in sys.argv  # e.g. resubmitted after the walltime of the last job
     while True:
-        p = Process(target=main)
+        p = Process(target=main, args=(resume,))
         p.start()
         p.join()
 
-        # if an error occurs
+        # if an error occurs, continue from checkpoints
         if p.exitcode != 0:
-            print("An error occurred in the child process. Restarting...")
+            print("An error occurred in the child process. Resuming...")
             p.terminate()
-            clearResults()
+            resume = True
         else:
             break
@@ -23,7 +23,7 @@ def simulationExample(method: str):
         'Hertzian', 'data'
     )
     state.initAsDisks()
-    state.setBoundaryScheduler(simu.BoundaryScheduler.constant, lambda n, x: x * q ** n)
+    state.setBoundaryScheduler(simu.Schedule.constant(), simu.Schedule.geometric(q))
     state.initPotential(4)
 
     for i in range(10000):
@@ -40,7 +40,7 @@ def simulationExample(method: str):
 def rebootExample():
     state = rebootSimulation('j5e5.h5')
     q = 1 - 1e-2
-    state.setBoundaryScheduler(simu.BoundaryScheduler.constant, lambda n, x: x * q ** n)
+    state.setBoundaryScheduler(simu.Schedule.constant(), simu.Schedule.geometric(q))
 
     for i in range(10000):
         if state.density > 1.0: break
@@ -60,7 +60,7 @@ def detectMemoryLeak():
         'Power:3.5', 'data'
     )
     state.initAsDisks()
-    state.setBoundaryScheduler(simu.BoundaryScheduler.constant, lambda n, x: x * q ** n)
+    state.setBoundaryScheduler(simu.Schedule.constant(), simu.Schedule.geometric(q))
     state.initPotential(4)
     monitor = MemoryMonitor()
 
@@ -0,0 +1,92 @@
+import os
+
+import h5py
+import numpy as np
+
+
+def cachePathOf(data_file: str) -> str:
+    # not *.h5, which would be taken as a data file
+    return os.path.splitext(data_file)[0] + '.analysis.hdf5'
+
+
+class AnalysisCache:
+    """
+    Persistent per-frame results of observables, stored next to a data file: data.h5 -> data.analysis.hdf5.
+    Each (observable, parameters) is a group with datasets:
+        id (frames,), fingerprint (frames, k): scalars of the frame when it was computed, value (frames, ...)
+    A cached value is valid only if the frame still has the same fingerprint,
+    so frames that are rewritten (e.g. after resuming from a checkpoint) are computed again.
+    Datasets are resizable, and updated in place, because HDF5 does not reclaim the space of deleted datasets.
+    """
+
+    def __init__(self, data_file: str):
+        self.path = cachePathOf(data_file)
+
+    @staticmethod
+    def key(name: str, params: dict = None) -> str:
+        if not params:
+            return name
+        params_str = ','.join(f'{k}={params[k]}' for k in sorted(params))
+        return f'{name}({params_str})'.replace('/', '_')
+
+    def load(self, key: str, ids: np.ndarray, fingerprints: np.ndarray) -> list:
+        """
+        returns: the cached value of each frame, or None if it is not cached or the frame has changed
+        """
+        values = [None] * len(ids)
+        if not os.path.exists(self.path):
+            return values
+        try:
+            with h5py.File(self.path, 'r') as f:
+                if key not in f:
+                    return values
+                grp = f[key]
+                row_of_id = {Id: row for row, Id in enumerate(grp['id'][...])}
+                cached_fingerprints = grp['fingerprint'][...]
+                cached_values = grp['value'][...]
+        except OSError as e:
+            print('Cannot read the analysis cache:', self.path, e)
+            return values
+        for i, Id in enumerate(ids):
+            row = row_of_id.get(Id)
+            if row is not None and np.array_equal(cached_fingerprints[row], fingerprints[i], equal_nan=True):
+                values[i] = cached_values[row]
+        return values
+
+    @staticmethod
+    def resizable(grp, columns: dict) -> bool:
+        return all(name in grp and grp[name].maxshape[0] is None and grp[name].shape[1:] == data.shape[1:]
+                   for name, data in columns.items())
+
+    def store(self, key: str, ids: np.ndarray, fingerprints: np.ndarray, values: np.ndarray):
+        """
+        insert or update the cached values of frames `ids`: rows of cached frames are overwritten,
+        and new frames are appended. The cache is skipped if the file cannot be written.
+        """
+        if len(ids) == 0:
+            return
+        columns = {'id': np.asarray(ids), 'fingerprint': np.asarray(fingerprints), 'value': np.asarray(values)}
+        try:
+            with h5py.File(self.path, 'a') as f:
+                if key in f and not self.resizable(f[key], columns):
+                    del f[key]  # a fixed-size layout of an older version, or values of another shape
+                if key not in f:
+                    grp = f.create_group(key)
+                    for name, data in columns.items():
+                        grp.create_dataset(name, data=data, maxshape=(None,) + data.shape[1:], chunks=True)
+                    return
+                grp = f[key]
+                row_of_id = {Id: row for row, Id in enumerate(grp['id'][...])}
+                rows = np.array([row_of_id.get(Id, -1) for Id in columns['id']], dtype=int)
+                cached = np.flatnonzero(rows >= 0)
+                cached = cached[np.argsort(rows[cached])]  # h5py writes rows in increasing order
+                new = np.flatnonzero(rows < 0)
+                n = grp['id'].shape[0]
+                for name, data in columns.items():
+                    if len(cached) > 0:
+                        grp[name][rows[cached]] = data[cached]
+                    if len(new) > 0:
+                        grp[name].resize(n + len(new), axis=0)
+                        grp[name][n:] = data[new]
+        except OSError as e:
+            print('Cannot write the analysis cache:', self.path, e)
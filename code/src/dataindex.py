@@ -0,0 +1,155 @@
+import glob
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+from src.myio import DataSet
+
+index_file_name = '.datasets.sqlite'
+
+
+def _toBuiltin(x):
+    # numpy scalars and arrays in h5 attrs
+    return x.tolist() if hasattr(x, 'tolist') else str(x)
+
+
+def summarize(path: str) -> tuple:
+    """
+    returns: (metadata, summary, error) of a data file, where `error` is None unless the file is broken.
+    Only builtin types are returned, so that this can run in another process.
+    """
+    try:
+        ds = DataSet.loadFrom(path, strict=True)
+        metadata = json.loads(json.dumps(ds.metadata, default=_toBuiltin))
+        summary = ds.summary()
+        summary = {'length': int(summary['length']), 'rho0': float(summary['rho0']),
+                   'Gamma0': float(summary['Gamma0'])}
+        return metadata, summary, None
+    except Exception as e:
+        return None, None, f'{type(e).__name__}: {e}'
+
+
+class ParallelMap:
+    """
+    called as: pmap(func, items), like ut.Map, over data files in a pool of at most `workers` processes.
+    h5py serializes HDF5 calls within a process, so threads would not read files in parallel.
+    """
+
+    min_items_per_worker = 8
+
+    def __init__(self, workers: int = None, progress=True):
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.progress = progress
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __call__(self, func, items: list) -> list:
+        if self.workers <= 1 or len(items) < self.min_items_per_worker * self.workers:
+            results = map(func, items)  # starting processes takes longer than reading a few files
+        else:
+            if self.executor is None:
+                # do not fork a process that may hold OpenMP threads of the kernel
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            chunk_size = max(1, len(items) // (4 * self.workers))
+            results = self.executor.map(func, items, chunksize=chunk_size)
+        lst = []
+        last_report = 0
+        for result in results:
+            lst.append(result)
+            if self.progress and (time.time() - last_report > 0.5 or len(lst) == len(items)):
+                print(f'\rLoading data files: {len(lst)}/{len(items)}', end='' if len(lst) < len(items) else '\n')
+                last_report = time.time()
+        return lst
+
+
+class DataIndex:
+    """
+    Per-directory index of data files, with one row per file: metadata, summary (see `DataSet.summary`),
+    and the mtime and size of the file. Only new or modified files are opened when the index is updated.
+    """
+    version = 2
+    columns = ['filename', 'mtime', 'size', 'error', 'metadata', 'length', 'rho0', 'Gamma0']
+    schema = """
+        CREATE TABLE IF NOT EXISTS datasets (
+            filename TEXT PRIMARY KEY, mtime REAL, size INTEGER, error TEXT,
+            metadata TEXT, length INTEGER, rho0 REAL, Gamma0 REAL
+        )
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self.path = os.path.join(self.directory, index_file_name)
+        self.broken: list[tuple[str, str]] = []  # (file, error) of broken files, see `datasets`
+
+    def scan(self, names: list[str], files: dict, map_func) -> dict:
+        """
+        read data files and make their rows
+        """
+        results = map_func(summarize, [os.path.join(self.directory, name) for name in names])
+        rows = {}
+        for name, (metadata, summary, error) in zip(names, results):
+            mtime, size = files[name]
+            if error is not None:
+                rows[name] = (name, mtime, size, error, '{}', 0, 0.0, 0.0)
+            else:
+                rows[name] = (name, mtime, size, None, json.dumps(metadata), int(summary['length']),
+                              float(summary['rho0']), float(summary['Gamma0']))
+        return rows
+
+    def update(self, map_func=None) -> list[tuple]:
+        """
+        synchronize the index with the directory, and return the rows
+        map_func: called as map_func(func, items) to read new or modified files, see `ParallelMap`
+        """
+        map_func = map_func if map_func is not None else (lambda func, items: list(map(func, items)))
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, '*.h5')):
+            stat = os.stat(path)
+            files[os.path.basename(path)] = (stat.st_mtime, stat.st_size)
+        try:
+            with closing(sqlite3.connect(self.path)) as conn, conn:
+                if conn.execute('PRAGMA user_version').fetchone()[0] != self.version:
+                    conn.execute('DROP TABLE IF EXISTS datasets')
+                    conn.execute(f'PRAGMA user_version = {self.version}')
+                conn.execute(self.schema)
+                rows = {row[0]: row for row in conn.execute(f'SELECT {", ".join(self.columns)} FROM datasets')}
+                removed = [(name,) for name in rows if name not in files]
+                conn.executemany('DELETE FROM datasets WHERE filename = ?', removed)
+                modified = [name for name, (mtime, size) in files.items()
+                            if name not in rows or rows[name][1] != mtime or rows[name][2] != size]
+                scanned = self.scan(modified, files, map_func)
+                conn.executemany(f'INSERT OR REPLACE INTO datasets VALUES ({", ".join("?" * len(self.columns))})',
+                                 list(scanned.values()))
+                rows.update(scanned)
+        except sqlite3.Error as e:
+            # e.g. a read-only directory: read all files without the index
+            print('Cannot use the index:', self.path, e)
+            rows = self.scan(list(files.keys()), files, map_func)
+        return [rows[name] for name in sorted(files)]
+
+    def datasets(self, map_func=None) -> list[DataSet]:
+        """
+        data sets of the directory, without opening files that are indexed and not modified.
+        Broken files are skipped, and recorded in `self.broken`.
+        """
+        result = []
+        self.broken = []
+        for filename, _, _, error, metadata, length, rho0, Gamma0 in self.update(map_func):
+            path = os.path.join(self.directory, filename)
+            if error is not None:
+                self.broken.append((path, error))
+                continue
+            result.append(DataSet.fromSummary(path, json.loads(metadata),
+                                              {'length': length, 'rho0': rho0, 'Gamma0': Gamma0}))
+        return result
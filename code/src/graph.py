@@ -1,50 +1,54 @@
-from functools import lru_cache
-
 import numpy as np
 
 
 class Graph:
+    """
+    Graph of sites in the CSR form of scipy: neighbors of i are indices[indptr[i]:indptr[i + 1]]
+    """
+
     def __init__(self, N):
         self.N = N
-        self.adjacency = np.full((N, 256), -1, dtype=np.int32)
-        self.counter = np.zeros((N,), dtype=np.int32)
-
-    def insert(self, idx, pt):
-        self.adjacency[idx, self.counter[idx]] = pt
-        self.counter[idx] += 1
+        self.indptr = np.zeros((N + 1,), dtype=np.int32)
+        self.indices = np.zeros((0,), dtype=np.int32)
 
     def from_delaunay(self, vertex_neighbor_vertices):
-        ind_ptr, data = vertex_neighbor_vertices
-        for i in range(self.N):
-            neighbors = data[ind_ptr[i]:ind_ptr[i + 1]]
-            self.adjacency[i, :len(neighbors)] = neighbors
-            self.counter[i] = len(neighbors)
+        self.indptr, self.indices = vertex_neighbor_vertices
         return self
 
-    @lru_cache(maxsize=None)
     def merge(self, modulus):
-        res = [set() for _ in range(modulus)]
-        homomorphism_mat = np.where(self.adjacency != -1, self.adjacency % modulus, -1)
-        j_max = self.N // modulus
-        for i in range(modulus):
-            for j in range(j_max):
-                line = homomorphism_mat[j * modulus + i]
-                res[i] |= set(line[line != -1])
-        return MergedGraph(res)
+        """
+        merge site i into particle i % modulus
+        """
+        sources = np.repeat(np.arange(self.N), np.diff(self.indptr))
+        return MergedGraph.fromPairs(modulus, sources % modulus, self.indices % modulus)
 
 
 class MergedGraph:
-    def __init__(self, lst: list[set]):
-        self.lst = lst
+    """
+    Neighbor graph of particles.
+    edges: (n_edges, 2) of i < j, each pair once, sorted
+    neighbors of i (itself excluded) are indices[indptr[i]:indptr[i + 1]]
+    """
 
-    def free_memory(self):
-        del self.lst  # It's strange that this memory will not be free automatically.
-        del self
-
-    def neighborsOf(self, idx) -> set[int]:
-        return self.lst[idx]
+    def __init__(self, N, edges: np.ndarray):
+        self.N = N
+        self.edges = edges
+        # both directions, sorted by source
+        directed = np.concatenate([edges, edges[:, ::-1]])
+        directed = directed[np.lexsort((directed[:, 1], directed[:, 0]))]
+        self.indices = directed[:, 1]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(directed[:, 0], minlength=N))])
+
+    @classmethod
+    def fromPairs(cls, N, i: np.ndarray, j: np.ndarray):
+        mask = i != j
+        lo = np.minimum(i, j)[mask].astype(np.int64)
+        hi = np.maximum(i, j)[mask].astype(np.int64)
+        keys = np.unique(lo * N + hi)
+        return cls(N, np.stack([keys // N, keys % N], axis=1))
+
+    def neighborsOf(self, idx) -> np.ndarray:
+        return self.indices[self.indptr[idx]:self.indptr[idx + 1]]
 
-    @lru_cache(maxsize=None)
     def neighborNums(self):
-        # -1: itself is not a neighbor
-        return np.array(list(map(len, self.lst))) - 1
+        return np.diff(self.indptr)
@@ -9,6 +9,7 @@ import numpy as np
 import src.utils as ut
 
 kernel_mode = 'Release'
+potential_format_version = 2  # 2: metadata with a checksum of the table in memory; 1: SHA-256 of the file
 
 
 def getLibraryPath():
@@ -29,6 +30,9 @@ class Kernel:
         self.lock = threading.Lock()
         self.potential_path = 'potential.dat'
         self.potential_meta_path = 'potential.metadata.json'
+        self.potential_power = 0
+        self.potential_cache_dir = None
+        self.use_mmap = False
         dll_path = getLibraryPath()
         self.dll = ct.cdll.LoadLibrary(dll_path)
         self.dll.init()
@@ -37,19 +41,31 @@ class Kernel:
         self.dll.declareRod.argtypes = [ct.c_int, ct.c_float]
         self.dll.setRod.argtypes = [ct.c_int, ct.c_float, ct.c_int]
         self.dll.setBoundary.argtypes = [ct.c_void_p, ct.c_float, ct.c_float]
+        self.dll.setThreads.argtypes = [ct.c_void_p, ct.c_int]
+        self.dll.setVerletSkin.argtypes = [ct.c_void_p, ct.c_float]
         self.dll.loadState.argtypes = [ct.c_void_p, ct.c_int, ct.c_float, ct.c_float]
         self.dll.loadState.restype = ct.c_void_p
         self.dll.freeState.argtypes = [ct.c_void_p]
         self.dll.readPotential.argtypes = [ct.c_int, ct.c_float]
+        self.dll.readPotentialFrom.argtypes = [ct.c_int, ct.c_float, ct.c_char_p, ct.c_bool]
+        self.dll.writePotentialTo.argtypes = [ct.c_char_p]
         self.dll.getPotentialId.restype = ct.c_int
+        self.dll.potentialChecksum.restype = ct.c_uint64
         self.dll.createState.argtypes = [ct.c_int, ct.c_float, ct.c_float]
         self.dll.createState.restype = ct.c_void_p
         self.dll.getSiblingId.argtypes = [ct.c_void_p]
         self.dll.getSiblingId.restype = ct.c_int
+        self.dll.getCores.restype = ct.c_int
         self.dll.getStateData.argtypes = [ct.c_void_p]
         self.dll.getStateData.restype = ct.c_void_p
         self.dll.getStateIterations.argtypes = [ct.c_void_p]
         self.dll.getStateIterations.restype = ct.c_int
+        self.dll.getStateRebuilds.argtypes = [ct.c_void_p]
+        self.dll.getStateRebuilds.restype = ct.c_int
+        self.dll.getStateGradientEvaluations.argtypes = [ct.c_void_p]
+        self.dll.getStateGradientEvaluations.restype = ct.c_int
+        self.dll.getStateEnergyEvaluations.argtypes = [ct.c_void_p]
+        self.dll.getStateEnergyEvaluations.restype = ct.c_int
         self.dll.getStateMaxGradOrEnergy.argtypes = [ct.c_void_p]
         self.dll.getStateMaxGradOrEnergy.restype = ct.c_void_p
         self.dll.getStateResidualForce.argtypes = [ct.c_void_p]
@@ -66,6 +82,14 @@ class Kernel:
         self.dll.eqLBFGS.restype = ct.c_float
         self.dll.eqMix.argtypes = [ct.c_void_p, ct.c_int]
         self.dll.eqMix.restype = ct.c_float
+        self.dll.eqFIRE.argtypes = [ct.c_void_p, ct.c_int]
+        self.dll.eqFIRE.restype = ct.c_float
+        self.dll.setOptimizerParams.argtypes = [ct.c_void_p, ct.c_int, ct.c_double, ct.c_double, ct.c_int, ct.c_int,
+                                                ct.c_double, ct.c_double, ct.c_double, ct.c_double]
+        self.dll.setFireParams.argtypes = [ct.c_void_p, ct.c_float, ct.c_float, ct.c_float, ct.c_int,
+                                           ct.c_float, ct.c_float, ct.c_float, ct.c_float]
+        self.dll.equilibriumBatch.argtypes = [ct.POINTER(ct.c_void_p), ct.c_int, ct.c_int, ct.POINTER(ct.c_int),
+                                              ct.c_int, ct.POINTER(ct.c_float), ct.POINTER(ct.c_int)]
         self.dll.setStateData.argtypes = [ct.c_void_p, ct.c_void_p]
         self.dll.landscapeAlongGradient.argtypes = [ct.c_void_p, ct.c_float, ct.c_int]
         self.dll.landscapeAlongGradient.restype = ct.c_void_p
@@ -89,13 +113,20 @@ class Kernel:
         self.dll.Si.restype = ct.c_void_p
         self.dll.neighborAngleDist.argtypes = [ct.c_void_p, ct.c_float, ct.c_int]
         self.dll.neighborAngleDist.restype = ct.c_void_p
+        self.dll.observables.argtypes = [ct.c_void_p, ct.c_float, ct.POINTER(ct.c_int), ct.c_int,
+                                         ct.POINTER(ct.c_float)]
+        self.dll.observablesBatch.argtypes = [ct.POINTER(ct.c_float), ct.POINTER(ct.c_float), ct.c_int, ct.c_int,
+                                              ct.c_float, ct.POINTER(ct.c_int), ct.c_int, ct.c_int,
+                                              ct.POINTER(ct.c_float)]
+        self.cores = self.dll.getCores()  # default number of threads of a state
 
     def returnFixedArray(self, dll_function, length):
         dll_function.restype = ct.POINTER(ct.c_float)
 
         def inner(*args):
             arr_ptr = dll_function(*args)
-            return np.array([arr_ptr[i] for i in range(length)])
+            # copy: the buffer is owned by the kernel and will be overwritten by the next call
+            return np.ctypeslib.as_array(arr_ptr, shape=(length,)).copy()
 
         return inner
 
@@ -105,14 +136,35 @@ class Kernel:
     def getSiblingId(self, address) -> int:
         return self.dll.getSiblingId(address)
 
-    def getStateData(self, address, N):
-        array_pointer = ct.cast(self.dll.getStateData(address), ct.POINTER(ct.c_float * N * 4))
-        raw_data = np.ctypeslib.as_array(array_pointer.contents).copy().reshape((N, 4))
-        return raw_data[:, :3]
+    def getStateData(self, address, N, copy=True):
+        """
+        copy=False: return a view of the live configuration in the kernel, without copying.
+        The view is only valid while the state exists, and changes as the state evolves.
+        It is read only: writing to it would bypass the caches of the state. Use `setStateData` instead.
+        """
+        array_pointer = ct.cast(self.dll.getStateData(address), ct.POINTER(ct.c_float))
+        raw_data = np.ctypeslib.as_array(array_pointer, shape=(N, 4))
+        if copy:
+            return raw_data[:, :3].copy()
+        view = raw_data[:, :3]
+        view.flags.writeable = False
+        return view
 
     def getNumOfIterations(self, address):
         return int(self.dll.getStateIterations(address))
 
+    def getNumOfRebuilds(self, address):
+        """
+        number of Verlet list rebuilds in the last equilibrium, 0 if the Verlet list is disabled
+        """
+        return int(self.dll.getStateRebuilds(address))
+
+    def getNumOfEvaluations(self, address) -> (int, int):
+        """
+        numbers of (gradient, energy) evaluations in the last equilibrium
+        """
+        return int(self.dll.getStateGradientEvaluations(address)), int(self.dll.getStateEnergyEvaluations(address))
+
     def getStateMaxGradOrEnergy(self, address):
         iterations = self.getNumOfIterations(address)
         if iterations == 0:
@@ -127,9 +179,8 @@ class Kernel:
         return self.getStateMaxGradOrEnergy(address)
 
     def getStateResidualForce(self, address, N):
-        array_pointer = ct.cast(self.dll.getStateResidualForce(address), ct.POINTER(ct.c_float * N * 4))
-        raw_data = np.ctypeslib.as_array(array_pointer.contents).copy().reshape((N, 4))
-        return raw_data[:, :3]
+        array_pointer = ct.cast(self.dll.getStateResidualForce(address), ct.POINTER(ct.c_float))
+        return np.ctypeslib.as_array(array_pointer, shape=(N, 4))[:, :3].copy()
 
     def getStateMaxResidualForce(self, address):
         return self.dll.getStateMaxResidualForce(address)
@@ -144,27 +195,69 @@ class Kernel:
         return self.dll.setEnums(potential_func)
 
     def setPotentialPower(self, power: float):
+        self.potential_power = power
         return self.dll.setPotentialPower(power)
 
+    def setPotentialCache(self, directory: str, use_mmap=True):
+        """
+        Store potential tables in a shared directory, keyed by (potential id, power, n, d).
+        If `use_mmap`, tables are mapped read-only, so that processes on one node share one copy.
+        """
+        self.potential_cache_dir = directory
+        self.use_mmap = use_mmap
+        os.makedirs(directory, exist_ok=True)
+
+    def potentialCachePaths(self, n, d):
+        name = f'potential_{self.dll.getPotentialId()}_{self.potential_power}_{n}_{d}'
+        return (os.path.join(self.potential_cache_dir, name + '.dat'),
+                os.path.join(self.potential_cache_dir, name + '.metadata.json'))
+
     def setBoundary(self, address, a, b):
         return self.dll.setBoundary(address, a, b)
 
+    def setThreads(self, address, threads: int):
+        """
+        number of OpenMP threads used by a state. The default is `CORES` in defs.h.
+        """
+        if threads < 1:
+            raise ValueError('The number of threads should be positive.')
+        return self.dll.setThreads(address, threads)
+
+    def setVerletSkin(self, address, skin: float):
+        """
+        skin > 0: enable the Verlet neighbor list with the cutoff 2 + skin; skin <= 0: disable it.
+        """
+        return self.dll.setVerletSkin(address, skin)
+
     def declareRod(self, n, d):
         self.dll.declareRod(n, d)
 
     def setRod(self, n, d, n_threads=4, save=True):
+        if self.potential_cache_dir is not None:
+            return self.setRodFromCache(n, d, n_threads)
         if not save:
             self.generatePotential(n, d, n_threads)
             return
-        if self.checkPotential(n, d):
+        if self.loadPotential(n, d):
             print("Load existing potential from file.")
-            self.readPotential(n, d)
         else:
             self.generatePotential(n, d, n_threads)
             self.writePotential(n, d)
 
+    def setRodFromCache(self, n, d, n_threads):
+        path, meta_path = self.potentialCachePaths(n, d)
+        if self.loadPotential(n, d, path, meta_path):
+            print("Load existing potential from cache:", path)
+        else:
+            self.generatePotential(n, d, n_threads)
+            # write to temporary files first, for other processes may be reading the cache
+            temp_path, temp_meta_path = f'{path}.{os.getpid()}.tmp', f'{meta_path}.{os.getpid()}.tmp'
+            self.writePotential(n, d, temp_path, temp_meta_path)
+            os.replace(temp_path, path)
+            os.replace(temp_meta_path, meta_path)
+
     def setStateData(self, address, configuration: np.ndarray):
-        return self.dll.setStateData(address, ut.ndarrayAddress(configuration.astype(np.float32)))
+        return self.dll.setStateData(address, ut.ndarrayAddress(configuration.astype(np.float32, copy=False)))
 
     def loadState(self, configuration: np.ndarray, N: int, a: float, b: float):
         """
@@ -192,38 +285,75 @@ class Kernel:
             print("you may forget to call `setEnums` to set a few key parameters")
             raise BaseException
 
-    def readPotential(self, n, d):
-        self.dll.readPotential(n, d)
+    def readPotential(self, n, d, path=None):
+        path = self.potential_path if path is None else path
+        self.dll.readPotentialFrom(n, d, path.encode(), self.use_mmap)
 
-    def checkPotential(self, n, d):
-        if not os.path.exists(self.potential_path) or not os.path.exists(self.potential_meta_path):
+    def loadPotential(self, n, d, path=None, meta_path=None):
+        """
+        returns False if there is no valid potential file, otherwise load it.
+        """
+        path = self.potential_path if path is None else path
+        meta_path = self.potential_meta_path if meta_path is None else meta_path
+        if not self.checkPotential(n, d, path, meta_path):
+            return False
+        self.readPotential(n, d, path)
+        if not self.verifyPotential(meta_path):
+            print("Potential file is broken:", path)
             return False
-        metadata = ut.readJson(self.potential_meta_path)
+        return True
+
+    def checkPotential(self, n, d, path=None, meta_path=None):
+        """
+        check the metadata and the size of the file. For the old format, also check the SHA-256 of the file.
+        """
+        path = self.potential_path if path is None else path
+        meta_path = self.potential_meta_path if meta_path is None else meta_path
+        if not os.path.exists(path) or not os.path.exists(meta_path):
+            return False
+        metadata = ut.readJson(meta_path)
 
         # check properties
         if metadata['n'] != n or metadata['d'] != d:
             return False
         if metadata['potential func id'] != self.dll.getPotentialId():
             return False
+        if metadata.get('power', self.potential_power) != self.potential_power:
+            return False
 
         # check file integrity
-        if metadata['size'] != ut.getFileSize(self.potential_path) or metadata['hash'] != ut.getFileHash(
-                self.potential_path):
+        if metadata['size'] != ut.getFileSize(path):
+            return False
+        if metadata.get('version', 1) < 2 and metadata['hash'] != ut.getFileHash(path):
             return False
         return True
 
-    def writePotential(self, n, d):
-        self.dll.writePotential()
+    def verifyPotential(self, meta_path=None):
+        """
+        compare the checksum of the loaded table with the one recorded when it was written
+        """
+        meta_path = self.potential_meta_path if meta_path is None else meta_path
+        metadata = ut.readJson(meta_path)
+        if metadata.get('version', 1) < 2:
+            return True  # already checked by the SHA-256 of the file
+        return metadata['checksum'] == self.dll.potentialChecksum()
+
+    def writePotential(self, n, d, path=None, meta_path=None):
+        path = self.potential_path if path is None else path
+        meta_path = self.potential_meta_path if meta_path is None else meta_path
+        self.dll.writePotentialTo(path.encode())
 
         # write metadata file
         metadata = {
             'n': n,
             'd': d,
             'potential func id': self.dll.getPotentialId(),
-            'size': ut.getFileSize(self.potential_path),
-            'hash': ut.getFileHash(self.potential_path),
+            'power': self.potential_power,
+            'version': potential_format_version,
+            'size': ut.getFileSize(path),
+            'checksum': self.dll.potentialChecksum(),
         }
-        ut.writeJson(self.potential_meta_path, metadata)
+        ut.writeJson(meta_path, metadata)
 
     def singleStep(self, address, mode: int, step_size: float):
         return self.dll.singleStep(address, mode, step_size)
@@ -240,6 +370,66 @@ class Kernel:
     def eqMix(self, address, max_iterations: int):
         return self.dll.eqMix(address, max_iterations)
 
+    def eqFIRE(self, address, max_iterations: int):
+        return self.dll.eqFIRE(address, max_iterations)
+
+    optimizer_params = {'lbfgs_m': 4, 'max_gradient': 1e-2, 'min_energy': 1e-3, 'energy_stride': 10,
+                        'energy_stride_gd': 1000, 'step_size': 1e-3, 'step_size_lbfgs': 5e-3, 'step_decay': 0.6,
+                        'min_step_size': 1e-4}  # defaults in `OptimizerParams`
+
+    def setOptimizerParams(self, address, **kwargs):
+        """
+        parameters of equilibriumGD, eqLineGD, eqLBFGS and eqMix (see `optimizer_params`),
+        where the missing ones are set to the defaults. The criteria are also used by eqFIRE.
+        """
+        unknown = set(kwargs) - set(self.optimizer_params)
+        if unknown:
+            raise ValueError(f'Unknown optimizer parameters: {unknown}')
+        params = {**self.optimizer_params, **kwargs}
+        if not 1 <= params['lbfgs_m'] <= 64:
+            raise ValueError('lbfgs_m should be in [1, 64].')
+        if params['energy_stride'] < 1 or params['energy_stride_gd'] < 1:
+            raise ValueError('Energy strides should be positive.')
+        self.dll.setOptimizerParams(address, *[params[key] for key in self.optimizer_params])
+
+    fire_params = {'dt': 1e-3, 'dt_max': 1e-2, 'max_step': 0.1, 'n_min': 5,
+                   'f_inc': 1.1, 'f_dec': 0.5, 'alpha_start': 0.1, 'f_alpha': 0.99}  # defaults in `FireParams`
+
+    def setFireParams(self, address, **kwargs):
+        """
+        parameters of eqFIRE (see `fire_params`), where the missing ones are set to the defaults
+        """
+        unknown = set(kwargs) - set(self.fire_params)
+        if unknown:
+            raise ValueError(f'Unknown FIRE parameters: {unknown}')
+        params = {**self.fire_params, **kwargs}
+        self.dll.setFireParams(address, *[params[key] for key in self.fire_params])
+
+    def equilibriumBatch(self, addresses: list, method: str, max_iterations, threads: int):
+        """
+        Relax states together on one thread pool of `threads` threads. Each state runs single-threaded.
+        max_iterations: an int, or a list of int for each state
+        returns: (energies, iterations), where the energy of a crashed state is nan
+        """
+        method_ids = {
+            'equilibriumGD': 0,
+            'eqLineGD': 1,
+            'eqLBFGS': 2,
+            'eqMix': 3,
+            'eqFIRE': 4,
+        }
+        if method not in method_ids:
+            raise ValueError(f'Unknown equilibrium method: {method}')
+        method_id = method_ids[method]
+        n = len(addresses)
+        its = np.broadcast_to(np.asarray(max_iterations, dtype=np.int32), (n,)).copy()
+        energies = np.zeros((n,), dtype=np.float32)
+        iterations = np.zeros((n,), dtype=np.int32)
+        self.dll.equilibriumBatch(
+            (ct.c_void_p * n)(*addresses), n, method_id, its.ctypes.data_as(ct.POINTER(ct.c_int)), threads,
+            energies.ctypes.data_as(ct.POINTER(ct.c_float)), iterations.ctypes.data_as(ct.POINTER(ct.c_int)))
+        return energies, iterations
+
     def landscapeAlongGradient(self, address, max_stepsize: float, n: int):
         return self.returnFixedArray(self.dll.landscapeAlongGradient, n)(address, max_stepsize, n)
 
@@ -248,7 +438,7 @@ class Kernel:
 
     def landscapeOnGradientSections(self, address, max_stepsize: float, n: int):
         m = (2 * n + 1) * n
-        mat = self.returnFixedArray(self.dll.landscapeOnGradientSections, m)(address, max_stepsize, m)
+        mat = self.returnFixedArray(self.dll.landscapeOnGradientSections, m)(address, max_stepsize, n)
         return mat.reshape((2 * n + 1, n))
 
     def ERoot(self, address, max_stepsize: float):
@@ -275,5 +465,52 @@ class Kernel:
     def neighborAngleDist(self, address, gamma: float, bins: int):
         return self.returnFixedArray(self.dll.neighborAngleDist, bins)(address, gamma, bins)
 
+    # observables computed together, in the order of `enum Observable` in defs.h
+    observable_ids = {'meanDistance': 0, 'meanZ': 1, 'meanS': 2, 'Phi4': 3, 'Phi6': 4, 'Si': 5}
+
+    def _observableLayout(self, props: list[str], N: int):
+        ids = np.array([self.observable_ids[prop] for prop in props], dtype=np.int32)
+        sizes = [N if prop == 'Si' else 1 for prop in props]
+        return ids, np.cumsum([0] + sizes)
+
+    def _unpackObservables(self, props: list[str], offsets, values: np.ndarray) -> dict:
+        return {prop: float(values[offsets[k]]) if offsets[k + 1] - offsets[k] == 1
+                else values[offsets[k]:offsets[k + 1]].copy() for k, prop in enumerate(props)}
+
+    def observables(self, address, N: int, gamma: float, props: list[str]) -> dict:
+        """
+        Several observables of a state in one call, see `observable_ids`.
+        The collision detection and the Delaunay triangulation are shared by all observables.
+        returns: {prop: value}, where Si is an array of N
+        """
+        ids, offsets = self._observableLayout(props, N)
+        values = np.zeros((offsets[-1],), dtype=np.float32)
+        self.dll.observables(address, gamma, ids.ctypes.data_as(ct.POINTER(ct.c_int)), len(ids),
+                             values.ctypes.data_as(ct.POINTER(ct.c_float)))
+        return self._unpackObservables(props, offsets, values)
+
+    def observablesBatch(self, configurations: np.ndarray, boundaries: np.ndarray, gamma: float, props: list[str],
+                         threads: int) -> list[dict]:
+        """
+        Observables of many frames in one call, distributed over `threads` OpenMP threads.
+        configurations: (frames, N, 3) or (frames, N, 4)
+        boundaries: (frames, 2) of (A, B)
+        returns: [{prop: value}] of each frame. Values of a crashed frame are nan.
+        This method is thread-safe: temporary kernel states are allocated under the lock.
+        """
+        n_frames, N = configurations.shape[:2]
+        frames = np.zeros((n_frames, N, 4), dtype=np.float32)
+        frames[:, :, :3] = configurations[:, :, :3]
+        boundaries = np.ascontiguousarray(boundaries, dtype=np.float32)
+        ids, offsets = self._observableLayout(props, N)
+        values = np.zeros((n_frames, offsets[-1]), dtype=np.float32)
+        if n_frames > 0:
+            with self.lock:
+                self.dll.observablesBatch(
+                    frames.ctypes.data_as(ct.POINTER(ct.c_float)), boundaries.ctypes.data_as(ct.POINTER(ct.c_float)),
+                    n_frames, N, gamma, ids.ctypes.data_as(ct.POINTER(ct.c_int)), len(ids), max(1, threads),
+                    values.ctypes.data_as(ct.POINTER(ct.c_float)))
+        return [self._unpackObservables(props, offsets, row) for row in values]
+
 
 ker = Kernel()
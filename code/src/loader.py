@@ -1,24 +1,88 @@
+import threading
+
 import numpy as np
 
 from src.kernel import ker
 from src.state import State
 import src.utils as ut
 
-class StateLoader(State):
-    def __init__(self, state: State):
-        self.__dict__ = state.__dict__
-        self.data_ptr = self.init_cpp()
 
-    def init_cpp(self):
-        # load the state to cpp
-        data_n4 = np.hstack([self.xyt, np.zeros((self.N, 1))]).reshape(-1)
-        return ker.loadState(data_n4, self.N, self.A, self.B)
+class KernelState:
+    """
+    A kernel state owned by one thread, which is reloaded by `setStateData` for each frame, instead of allocating
+    a kernel state per frame. The kernel state caches the collision detection and the Delaunay triangulation
+    until the next frame is loaded, so observables of one frame share them.
+    """
+
+    def __init__(self, N: int):
+        self.N = N
+        self.data_ptr = None
+        self.buffer = np.zeros((N, 4), dtype=np.float32)
+        self.loaded = None  # configuration in the kernel state, held to compare by identity
+        self.boundary = None
+
+    def load(self, state: State):
+        if self.loaded is not state.xyt or self.boundary != (state.A, state.B):
+            self.buffer[:, :3] = state.xyt
+            if self.data_ptr is None:
+                self.data_ptr = ker.loadState(self.buffer, self.N, state.A, state.B)
+            else:
+                ker.setBoundary(self.data_ptr, state.A, state.B)
+                ker.setStateData(self.data_ptr, self.buffer)
+            self.loaded = state.xyt
+            self.boundary = (state.A, state.B)
+        return self.data_ptr
 
     def __del__(self):
-        ker.freeState(self.data_ptr)
+        if self.data_ptr is not None:
+            ker.freeState(self.data_ptr)
+
+
+class _ThreadKernelStates(threading.local):
+    def __init__(self):
+        # kernel states are freed when the thread exits
+        self.states: dict[int, KernelState] = {}
+
+
+_thread_kernel_states = _ThreadKernelStates()
+
+
+def kernelStateOf(N: int) -> KernelState:
+    """
+    the kernel state of this thread for N particles
+    """
+    states = _thread_kernel_states.states
+    if N not in states:
+        states[N] = KernelState(N)
+    return states[N]
+
+
+def observablesOfFrames(states: list[State], props: list[str], threads: int = None) -> list[dict]:
+    """
+    kernel observables (see `Kernel.observable_ids`) of frames with the same N and gamma, in one kernel call
+    threads: the default is the default number of threads of a kernel state (`Kernel.cores`)
+    """
+    if len(states) == 0:
+        return []
+    if threads is None:
+        threads = ker.cores
+    configurations = np.stack([state.xyt for state in states])
+    boundaries = np.array([(state.A, state.B) for state in states])
+    return ker.observablesBatch(configurations, boundaries, states[0].gamma, props, threads)
+
+
+class StateLoader(State):
+    def __init__(self, state: State):
+        # a shallow copy: loaders of the same state may be used in several threads
+        self.__dict__ = state.__dict__.copy()
+
+    @property
+    def data_ptr(self):
+        # load the state to the kernel state of the current thread, if it is not loaded
+        return kernelStateOf(self.N).load(self)
 
     def meanDistance_(self):
-        return ker.meanDistance(self.data_ptr)
+        return ker.meanDistance(self.data_ptr, self.gamma)
 
     def meanContactZ_(self):
         return ker.meanContactZ(self.data_ptr, self.gamma)
@@ -34,3 +98,6 @@ class StateLoader(State):
 
     def neighborAngleDist_(self, bins: int):
         return ker.neighborAngleDist(self.data_ptr, self.gamma, bins)
+
+    def observables_(self, props: list[str]) -> dict:
+        return ker.observables(self.data_ptr, self.N, self.gamma, props)
@@ -1,4 +1,11 @@
+import atexit
 import os.path
+import signal
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import lru_cache
 from typing import Union
 
@@ -7,6 +14,7 @@ import numpy as np
 import pandas as pd
 
 import src.utils as ut
+from src.analysiscache import AnalysisCache
 from src.state import State
 
 
@@ -22,20 +30,254 @@ def countH5Groups(file_path):
         return sum(1 for _ in f.values() if isinstance(_, h5py.Group))
 
 
+"""
+Layouts of data files:
+'groups': (legacy) one group per frame, with a dataset 'data' of the configuration and frame metadata in attrs.
+'columnar': one resizable dataset per column, indexed by frame:
+    configuration (frames, N, 3), id, A, B, energy, max_residual_force (frames,), energy_curve (frames,) of vlen.
+    Storage options of columns are file attrs, applied when the columns are created:
+    'compression': 'gzip' or 'lzf' (with the shuffle filter), or 'none'
+    'decimals': if given, configurations are quantized to this many decimal places by the HDF5 scale-offset filter,
+        i.e. x, y and theta are kept within 0.5 * 10 ** -decimals
+"""
+scalar_columns = ['id', 'A', 'B', 'energy', 'max_residual_force']
+storage_attrs = ['layout', 'compression', 'decimals']  # file attrs which are not metadata
+
+
+def h5Layout(h5_file_handle) -> str:
+    return h5_file_handle.attrs.get('layout', 'groups')
+
+
+def setStorageAttrs(h5_file_handle, compression: str = None, decimals: int = None):
+    if compression not in [None, 'none', 'gzip', 'lzf']:
+        raise ValueError("Invalid compression. Please set it to 'gzip', 'lzf' or None.")
+    h5_file_handle.attrs['compression'] = compression or 'none'
+    if decimals is not None:
+        h5_file_handle.attrs['decimals'] = decimals
+
+
+def storageFilters(h5_file_handle) -> dict:
+    """
+    keyword arguments of `create_dataset` of configurations for the storage options of a file.
+    Scalar columns are not compressed: their chunks are rewritten by each append, and compressed chunks
+    that change size are reallocated, which makes files larger rather than smaller.
+    """
+    compression = h5_file_handle.attrs.get('compression', 'none')
+    filters = {} if compression == 'none' else {'compression': compression, 'shuffle': True}
+    if 'decimals' in h5_file_handle.attrs:
+        filters['scaleoffset'] = int(h5_file_handle.attrs['decimals'])
+    return filters
+
+
+def createColumns(h5_file_handle, N: int):
+    f = h5_file_handle
+    f.create_dataset('configuration', shape=(0, N, 3), maxshape=(None, N, 3), chunks=(1, N, 3), dtype=np.float32,
+                     **storageFilters(f))
+    for key in scalar_columns:
+        f.create_dataset(key, shape=(0,), maxshape=(None,), chunks=(1024,),
+                         dtype=np.int64 if key == 'id' else np.float64)
+    f.create_dataset('energy_curve', shape=(0,), maxshape=(None,), chunks=(256,),
+                     dtype=h5py.vlen_dtype(np.float32))
+
+
+def resizeColumns(h5_file_handle, n: int):
+    for key in ['configuration', 'energy_curve'] + scalar_columns:
+        h5_file_handle[key].resize(n, axis=0)
+
+
+def writeFrames(h5_file_handle, states: list[State]):
+    """
+    append frames to a file of the columnar layout
+    """
+    f = h5_file_handle
+    if len(states) == 0:
+        return
+    if 'configuration' not in f:
+        createColumns(f, states[0].xyt.shape[0])
+    start = f['configuration'].shape[0]
+    end = start + len(states)
+    resizeColumns(f, end)
+    f['configuration'][start:end] = np.array([state.xyt for state in states])
+    metadata = [state.metadata for state in states]
+    for key in scalar_columns:
+        f[key][start:end] = np.array([m[key] for m in metadata])
+    for i, m in enumerate(metadata):
+        f['energy_curve'][start + i] = np.asarray(m['energy_curve'], dtype=np.float32)
+
+
+def convertToColumnar(filename: str, dst: str = None, compression: str = None, decimals: int = None):
+    """
+    Convert a data file of the 'groups' layout to the 'columnar' layout, or rewrite a columnar file
+    with other storage options (see the layouts above).
+    If `dst` is None, the file is replaced after the conversion succeeds.
+    """
+    src = DataSet.loadFrom(filename)
+    if src is None:
+        raise ValueError(f'broken data file: {filename}')
+    dst = filename if dst is None else dst
+    temp_file = f'{dst}.{os.getpid()}.tmp'
+    with h5py.File(temp_file, 'w') as f:
+        for key, value in src.metadata.items():
+            f.attrs[key] = value
+        f.attrs['layout'] = 'columnar'
+        setStorageAttrs(f, compression, decimals)
+        for block in src.data.blocks():
+            writeFrames(f, block)
+    os.replace(temp_file, dst)
+
+
+class FrameSequence:
+    """
+    Lazy sequence of the frames of a data file. Frames are loaded on demand, block by block when iterated,
+    and decoded frames are kept in an LRU cache of at most `max_bytes`.
+    """
+    block_size = 64
+
+    def __init__(self, dataset: 'DataSet', max_bytes: int):
+        self.dataset = dataset
+        self.max_bytes = max_bytes
+        self.length = dataset.length
+        self._cache: OrderedDict[int, State] = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()  # frames are read by analysis threads
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        index = int(index)
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('frame index out of range')
+        return self.load(index, index + 1)[0]
+
+    def __iter__(self):
+        for block in self.blocks():
+            yield from block
+
+    def blocks(self, rows: list[int] = None):
+        """
+        rows: if given, only yield these frames (in ascending order), still loaded block by block
+        """
+        if rows is None:
+            for start in range(0, self.length, self.block_size):
+                yield self.load(start, min(start + self.block_size, self.length))
+            return
+        rows = sorted(rows)
+        i = 0
+        while i < len(rows):
+            start = rows[i] - rows[i] % self.block_size
+            end = min(start + self.block_size, self.length)
+            block = self.load(start, end)
+            selected = []
+            while i < len(rows) and rows[i] < end:
+                selected.append(block[rows[i] - start])
+                i += 1
+            yield selected
+
+    def load(self, start: int, end: int) -> list[State]:
+        with self._lock:
+            cached = [self._cache.get(i) for i in range(start, end)]
+            for i in range(start, end):
+                if i in self._cache:
+                    self._cache.move_to_end(i)
+        if all(state is not None for state in cached):
+            return cached
+        states = self.dataset.load_range(start, end)
+        with self._lock:
+            for i, state in enumerate(states):
+                self._put(start + i, state)
+        return states
+
+    def _put(self, row: int, state: State):
+        size = stateBytes(state)
+        if row in self._cache or size > self.max_bytes:
+            return
+        self._cache[row] = state
+        self._cached_bytes += size
+        while self._cached_bytes > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= stateBytes(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+
+def stateBytes(state: State) -> int:
+    return state.xyt.nbytes + np.asarray(state.energy_curve).nbytes
+
+
+_open_writers = weakref.WeakSet()
+_signal_handlers_installed = False
+
+
+def closeWriters():
+    """
+    flush and close all data files opened in the writer mode
+    """
+    for dataset in list(_open_writers):
+        dataset.closeWriter()
+
+
+def _closeWritersOnSignal(signum, frame):
+    closeWriters()
+    previous_handler = _previous_handlers.get(signum)
+    if callable(previous_handler):
+        return previous_handler(signum, frame)
+    # terminate as the signal would have done
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+_previous_handlers = {}
+atexit.register(closeWriters)
+
+
+def _installSignalHandlers():
+    """
+    Close writers on SIGTERM (e.g. sent by PBS at the walltime). Signal handlers can only be set in the main thread,
+    otherwise writers are closed at exit only.
+    """
+    global _signal_handlers_installed
+    if _signal_handlers_installed or threading.current_thread() is not threading.main_thread():
+        return
+    for signum in [signal.SIGTERM]:
+        _previous_handlers[signum] = signal.signal(signum, _closeWritersOnSignal)
+    _signal_handlers_installed = True
+
+
 class DataSet:
+    max_cache_bytes = 1 << 28  # memory cap of decoded frames of each data set, see `FrameSequence`
+    # storage options of new files, see the layouts above. Opt in, e.g. `DataSet.compression = 'gzip'`
+    compression = 'none'
+    decimals = None
+
     def __init__(self, filename: str, metadata: dict):
         self.filename = filename
         self.metadata: dict = metadata  # See State.metadata
         self._data: list[State] = []
+        self._layout = None
+        self._writer = None  # h5py file handle in the writer mode
+        self._buffer: list[State] = []
+        self._frames = None
+        self._keys = None  # group names sorted by frame id, for the 'groups' layout
+        self._summary = None  # see `summary`
         # save metadata first, even if there is no data
         # if it is not in the reading mode and not in the appending mode
-        if isH5FileEmpty(filename) and len(metadata) > 0:
+        if len(metadata) > 0 and isH5FileEmpty(filename):
             with h5py.File(self.filename, 'w') as f:
                 for key, value in self.metadata.items():
                     f.attrs[key] = value
+                f.attrs['layout'] = 'columnar'
+                setStorageAttrs(f, self.compression, self.decimals)
 
     def __len__(self):
-        return self.length
+        return self._summary['length'] if self._summary is not None else self.length
 
     def __getattr__(self, name):
         """
@@ -50,14 +292,65 @@ class DataSet:
     def id(self):
         return ut.fileNameToId(self.filename)
 
+    @contextmanager
+    def _file(self, mode: str):
+        """
+        In the writer mode, use the open handle after flushing buffered frames. Otherwise, open the file.
+        """
+        if self._writer is not None:
+            self.flush()
+            yield self._writer
+        else:
+            with h5py.File(self.filename, mode) as f:
+                yield f
+
     @property
-    def data(self):
-        if not self._data:
-            with h5py.File(self.filename, 'r') as f:
-                for key in f.keys():
-                    self._data.append(self.load_key(f, key))
-            self._data.sort(key=lambda x: x.id)
-        return self._data
+    def layout(self):
+        if self._layout is None:
+            with self._file('r') as f:
+                self._layout = h5Layout(f)
+        return self._layout
+
+    @property
+    def data(self) -> FrameSequence:
+        """
+        frames sorted by id, loaded on demand
+        """
+        if self._frames is None:
+            self._frames = FrameSequence(self, self.max_cache_bytes)
+        return self._frames
+
+    def setCacheLimit(self, max_bytes: int):
+        self.max_cache_bytes = max_bytes
+        self._frames = None
+
+    def sorted_keys(self, h5_file_handle) -> list[str]:
+        if self._keys is None:
+            f = h5_file_handle
+            self._keys = sorted(f.keys(), key=lambda key: f[key].attrs['id'])
+        return self._keys
+
+    def load_range(self, start: int, end: int) -> list[State]:
+        """
+        load frames [start, end) in the order of id
+        """
+        with self._file('r') as f:
+            if self.layout == 'columnar':
+                configurations = f['configuration'][start:end]
+                columns = {key: f[key][start:end] for key in scalar_columns + ['energy_curve']}
+                return [State.load(configurations[i], self.metadata,
+                                   {key: value[i] for key, value in columns.items()})
+                        for i in range(len(configurations))]
+            return [self.load_key(f, key) for key in self.sorted_keys(f)[start:end]]
+
+    def column(self, key: str) -> np.ndarray:
+        """
+        a scalar property (id, A, B, energy, max_residual_force) of all frames, without loading configurations
+        """
+        with self._file('r') as f:
+            if self.layout == 'columnar':
+                return f[key][...] if key in f else np.zeros((0,))
+            return np.array([f[k].attrs[key] for k in self.sorted_keys(f)])
 
     @property
     def data_head(self):
@@ -65,13 +358,14 @@ class DataSet:
 
     def load_data_by_id(self, Id) -> State:
         try:
-            with h5py.File(self.filename, 'r') as f:
+            with self._file('r') as f:
+                if self.layout == 'columnar':
+                    return self.load_row(f, self.row_of_id(f, Id))
                 for key in f.keys():
                     if f[key].attrs['id'] == Id:
                         return self.load_key(f, key)
-        except:
-            print('broken data file:', self.filename)
-            raise ValueError
+        except Exception as e:
+            raise ValueError(f'broken data file: {self.filename}') from e
 
     def load_key(self, h5_file_handle, key) -> State:
         try:
@@ -80,30 +374,73 @@ class DataSet:
             for k in h5_file_handle[key].attrs.keys():
                 dic[k] = h5_file_handle[key].attrs[k]
             return State.load(configuration, self.metadata, dic)
-        except:
-            print('broken data file:', self.filename)
-            raise ValueError
+        except Exception as e:
+            raise ValueError(f'broken data file: {self.filename}') from e
+
+    @staticmethod
+    def row_of_id(h5_file_handle, Id) -> int:
+        """
+        Frame ids are consecutive in a simulation, so the row is found in O(1) unless the ids are not.
+        """
+        ids = h5_file_handle['id']
+        if ids.shape[0] > 0:
+            row = int(Id - ids[0])
+            if 0 <= row < ids.shape[0] and ids[row] == Id:
+                return row
+        return int(np.nonzero(ids[...] == Id)[0][0])
+
+    def load_row(self, h5_file_handle, row: int) -> State:
+        f = h5_file_handle
+        dic = {key: f[key][row] for key in scalar_columns}
+        dic['energy_curve'] = f['energy_curve'][row]
+        return State.load(f['configuration'][row], self.metadata, dic)
 
     @property
     def length(self):
-        with h5py.File(self.filename, 'r') as f:
+        with self._file('r') as f:
+            if self.layout == 'columnar':
+                return f['id'].shape[0] if 'id' in f else 0
             return len(f.keys())
 
     @classmethod
-    def loadFrom(cls, filename) -> Union['DataSet', None]:
+    def loadFrom(cls, filename, strict=False) -> Union['DataSet', None]:
+        """
+        strict: raise the exception if the file is broken, instead of printing it and returning None
+        """
         obj = cls(filename, dict())
         try:
             with h5py.File(filename, 'r') as f:
                 for key in f.attrs.keys():
-                    obj.metadata[key] = f.attrs[key]
+                    if key not in storage_attrs:
+                        obj.metadata[key] = f.attrs[key]
             # check data integrity
             _ = obj.data_head
             return obj
         except Exception as e:
+            if strict:
+                raise
             print('An error occurred:', e)
             print('while reading:', filename)
             return None
 
+    @classmethod
+    def fromSummary(cls, filename, metadata: dict, summary: dict) -> 'DataSet':
+        """
+        a data set whose metadata and summary are known (e.g. from `DataIndex`), without opening the file
+        """
+        obj = cls(filename, dict())
+        obj.metadata.update(metadata)
+        obj._summary = summary
+        return obj
+
+    def summary(self) -> dict:
+        """
+        scalar information for listing data sets: length, rho0 and Gamma0
+        """
+        if self._summary is not None:
+            return self._summary
+        return {'length': self.length, 'rho0': self.rho0, 'Gamma0': self.Gamma0}
+
     # Simulation Methods
 
     def append(self, state: State, need_data_in_python=False):
@@ -111,18 +448,112 @@ class DataSet:
             self._data.append(state)
         else:
             self._data.append(None)
+        self._frames = None
+        self._keys = None
+        self._summary = None
         self.increase(state)
 
     def increase(self, state: State):
-        n_existing_groups = len(self._data)
+        if self._writer is not None:
+            self._buffer.append(state)
+            if (len(self._buffer) >= self._writer_options['max_frames'] or
+                    time.time() - self._last_flush >= self._writer_options['max_seconds']):
+                self.flush()
+            return
+        layout = self.layout
         with h5py.File(self.filename, 'a') as f:
-            grp = f.create_group(str(n_existing_groups))
+            self.writeStates(f, layout, [state])
+
+    def writeStates(self, h5_file_handle, layout: str, states: list[State]):
+        """
+        write the last `len(states)` frames appended
+        """
+        if layout == 'columnar':
+            return writeFrames(h5_file_handle, states)
+        n_existing_groups = len(self._data) - len(states)
+        for i, state in enumerate(states):
+            grp = h5_file_handle.create_group(str(n_existing_groups + i + 1))
             grp.create_dataset('data', data=state.xyt)
             for key, value in state.metadata.items():
                 grp.attrs[key] = value
 
+    # Writer Mode
+
+    def openWriter(self, max_frames=32, max_seconds=30.0, durability='flush'):
+        """
+        Keep the file open and buffer appended frames, until `max_frames` frames are buffered or `max_seconds` passed
+        since the last flush. Then frames are written in bulk.
+        durability:
+            'buffer': leave written frames to the HDF5 cache until the file is closed
+            'flush': flush the file to the OS after each bulk write, which survives a crash of the process
+            'fsync': also fsync the file after each bulk write, which survives a crash of the node
+        Writers are closed at exit, and on SIGTERM if this is called in the main thread.
+        """
+        if durability not in ['buffer', 'flush', 'fsync']:
+            raise ValueError("Invalid durability. Please set it to 'buffer', 'flush' or 'fsync'.")
+        if self._writer is not None:
+            return
+        self._layout = self.layout
+        self._writer_options = {'max_frames': max_frames, 'max_seconds': max_seconds, 'durability': durability}
+        self._writer = h5py.File(self.filename, 'a')
+        self._last_flush = time.time()
+        _open_writers.add(self)
+        _installSignalHandlers()
+
+    def flush(self):
+        """
+        write buffered frames in the writer mode
+        """
+        if self._writer is None:
+            return
+        if self._buffer:
+            self.writeStates(self._writer, self._layout, self._buffer)
+            self._buffer = []
+        durability = self._writer_options['durability']
+        if durability in ['flush', 'fsync']:
+            self._writer.flush()
+        if durability == 'fsync':
+            os.fsync(self._writer.id.get_vfd_handle())
+        self._last_flush = time.time()
+
+    def closeWriter(self):
+        if self._writer is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._writer.close()
+            self._writer = None
+            _open_writers.discard(self)
+
+    def truncate(self, n: int):
+        """
+        keep the first n frames in the file, and append new frames after them
+        """
+        layout = self.layout
+        with self._file('a') as f:
+            if layout == 'columnar':
+                if 'id' in f:
+                    resizeColumns(f, min(n, f['id'].shape[0]))
+            else:
+                for key in list(f.keys()):
+                    if int(key) > n:  # groups are named from 1, see `increase`
+                        del f[key]
+        self._data = [None] * n
+        self._frames = None
+        self._keys = None
+        self._summary = None
+
     def saveAll(self):
+        layout = self.layout
+        self.closeWriter()
         with h5py.File(self.filename, 'w') as f:
+            for key, value in self.metadata.items():
+                f.attrs[key] = value
+            if layout == 'columnar':
+                f.attrs['layout'] = 'columnar'
+                setStorageAttrs(f, self.compression, self.decimals)
+                return writeFrames(f, self._data)
             for i, state in enumerate(self._data):
                 grp = f.create_group(str(i))
                 grp.create_dataset('data', data=state.xyt)
@@ -147,11 +578,94 @@ class DataSet:
     def descentCurves(self):
         return [state.descent_curve for state in self.data]
 
+    def mapFrames(self, func, parallel_mode='Release', rows: list[int] = None) -> list:
+        """
+        ut.Map over frames block by block, so that only a block of frames is in memory
+        rows: if given, only map these frames
+        """
+        result = []
+        for block in self.data.blocks(rows):
+            result.extend(ut.Map(parallel_mode)(func, block))
+        return result
+
+    def cachedObservable(self, name: str, func, parallel_mode='Release', params: dict = None) -> np.ndarray:
+        """
+        func(state) of every frame, stored in the analysis cache next to the data file (see `AnalysisCache`).
+        Only frames which are not cached, e.g. appended, or changed since they were cached, are computed.
+        Results that are not numerical are not cached.
+        """
+        return self.cachedObservables({name: params}, lambda state: {name: func(state)}, parallel_mode)[name]
+
+    def cachedObservables(self, params: dict, func, parallel_mode='Release', batch=False) -> dict:
+        """
+        Several observables in one sweep over frames, see `cachedObservable`.
+        params: {name: parameters of the observable}
+        func: state -> {name: value}, or if batch: list of states -> list of {name: value}, called once per block
+        """
+        ids = self.column('id')
+        fingerprints = np.stack([self.column(key) for key in ['A', 'B', 'energy']], axis=1)
+        cache = AnalysisCache(self.filename)
+        keys = {name: cache.key(name, p) for name, p in params.items()}
+        values = {name: cache.load(keys[name], ids, fingerprints) for name in params}
+        missing = {name: [row for row, value in enumerate(values[name]) if value is None] for name in params}
+        rows = sorted(set(sum(missing.values(), [])))
+        if batch:
+            results = [result for block in self.data.blocks(rows) for result in func(block)]
+        else:
+            results = self.mapFrames(func, parallel_mode, rows)
+        for row, result in zip(rows, results):
+            for name in params:
+                if values[name][row] is None:
+                    values[name][row] = result[name]
+        curves = {}
+        for name in params:
+            try:
+                curves[name] = np.array(values[name], dtype=float)
+            except (TypeError, ValueError):
+                curves[name] = np.array(values[name])
+                continue
+            if missing[name]:
+                rows_of_name = missing[name]
+                cache.store(keys[name], ids[rows_of_name], fingerprints[rows_of_name], curves[name][rows_of_name])
+        return curves
+
     @lru_cache(maxsize=None)
     def curveTemplate(self, prop: str):
-        # parallel calculation will cause a crash??
-        parallel_mode = 'Debug' if prop in ['meanDistance', 'finalStepSize'] else 'Release'
-        return np.array(ut.Map(parallel_mode)(lambda state: getattr(state, prop), self.data))
+        if prop in ['energy', 'max_residual_force']:
+            return self.column(prop)
+        if prop == 'rho':
+            return self.N / (np.pi * self.column('A') * self.column('B'))
+        if prop == 'phi':
+            return self.curveTemplate('rho') * (np.pi + 4 * (self.gamma - 1)) / self.gamma ** 2
+        # each kernel state owns its result buffers, but line searches still share temporary states
+        parallel_mode = 'Debug' if prop in ['finalStepSize'] else 'Release'
+        return self.cachedObservable(prop, lambda state: getattr(state, prop), parallel_mode, {'gamma': self.gamma})
+
+    def curveTemplates(self, props: list[str]) -> dict:
+        """
+        curveTemplate of several properties, in one sweep over frames (see `State.observables`)
+        """
+        curves = {}
+        frame_props = []
+        for prop in props:
+            if prop in ['energy', 'max_residual_force', 'rho', 'phi']:
+                curves[prop] = self.curveTemplate(prop)
+            else:
+                frame_props.append(prop)
+        from src.kernel import ker
+        from src.loader import observablesOfFrames
+        kernel_props = [prop for prop in frame_props if prop in ker.observable_ids]
+        frame_props = [prop for prop in frame_props if prop not in ker.observable_ids]
+        if kernel_props:
+            # a block of frames per kernel call, see `Kernel.observablesBatch`
+            curves.update(self.cachedObservables({prop: {'gamma': self.gamma} for prop in kernel_props},
+                                                 lambda states: observablesOfFrames(states, kernel_props),
+                                                 batch=True))
+        if frame_props:
+            parallel_mode = 'Debug' if 'finalStepSize' in frame_props else 'Release'
+            curves.update(self.cachedObservables({prop: {'gamma': self.gamma} for prop in frame_props},
+                                                 lambda state: state.observables(frame_props), parallel_mode))
+        return curves
 
     @property
     def rhos(self):
@@ -169,15 +683,18 @@ class DataSet:
         """
         Extract abstract information and construct a line of the dataframe
         """
-        dic = {
+        return pd.DataFrame([self.abstract()])
+
+    def abstract(self) -> dict:
+        summary = self.summary()
+        return {
             'id': self.id,
-            'length': self.length,
+            'length': summary['length'],
             'gamma': self.gamma,
-            'rho0': self.rho0,
-            'Gamma0': self.Gamma0,
+            'rho0': summary['rho0'],
+            'Gamma0': summary['Gamma0'],
             **self.metadata,
         }
-        return pd.DataFrame([dic])
 
     def stateAtDensity(self, density: float) -> State:
         dr = np.abs(self.rhos - density)
@@ -192,10 +709,23 @@ class DataSet:
         return self.data[idx]
 
     def angleDistribution(self):
-        return np.array(ut.Map('Release')(lambda x: x.angleDistribution(), self.data)).T
+        # KDE of a block of frames at once, see `ut.KDE_distributions`
+        def func(states):
+            _, dists = ut.KDE_distributions([state.t for state in states], (0, np.pi), periodic=True)
+            return [{'angleDistribution': dist} for dist in dists]
+
+        return self.cachedObservables({'angleDistribution': {'bins': ut.bins_of_distribution, 'periodic': True}},
+                                      func, batch=True)['angleDistribution'].T
 
     def SiDistribution(self):
-        return np.array(ut.Map('Release')(lambda x: x.SiDistribution(), self.data)).T
+        from src.loader import observablesOfFrames
+
+        def func(states):
+            sis = [obs['Si'] for obs in observablesOfFrames(states, ['Si'])]
+            return [{'SiDistribution': dist} for dist in ut.KDE_distributions(sis, (0, 1))[1]]
+
+        return self.cachedObservables({'SiDistribution': {'bins': ut.bins_of_distribution, 'gamma': self.gamma}},
+                                      func, batch=True)['SiDistribution'].T
 
     def neighborAngleDist(self):
-        return np.array(ut.Map('Debug')(lambda x: x.neighborAngleDist, self.data)).T
\ No newline at end of file
+        return self.cachedObservable('neighborAngleDist', lambda x: x.neighborAngleDist, 'Debug').T
\ No newline at end of file
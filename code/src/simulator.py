@@ -1,46 +1,170 @@
+import os
 import time
 
 import numpy as np
-import sympy as sp
 
 from src.kernel import ker
 from src.myio import DataSet
 from src.render import State
 
 
+class Schedule:
+    """
+    A numeric schedule of a boundary: values :: (x0: float, ns: np.ndarray) -> np.ndarray, vectorized in the step n,
+    with values(x0, 0) == x0.
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+    @staticmethod
+    def constant():
+        return Schedule(lambda x0, ns: np.full(ns.shape, x0, dtype=float))
+
+    @staticmethod
+    def geometric(q: float):
+        """
+        x_n = x0 * q^n
+        """
+        return Schedule(lambda x0, ns: x0 * q ** ns)
+
+    @staticmethod
+    def linearDensity(rate: float):
+        """
+        x_n = x0 / (1 + rate * n), so that the density grows linearly, by `rate` times the initial density per step,
+        if the other side of the boundary is constant.
+        """
+        return Schedule(lambda x0, ns: x0 / (1 + rate * ns))
+
+    @staticmethod
+    def table(values: np.ndarray):
+        """
+        values: the boundary at step 1, 2, ... The last value is kept after the end of the table.
+        """
+        values = np.asarray(values, dtype=float)
+
+        def tabulated(x0, ns):
+            full = np.concatenate([[x0], values])
+            return full[np.minimum(ns, len(values))]
+
+        return Schedule(tabulated)
+
+    @staticmethod
+    def symbolic(func):
+        """
+        func :: (n: sympy.Symbol, x: sympy.Symbol) -> sympy.Expr, lambda expression.
+        x is solved from func(0, x) == x0. sympy is only imported for symbolic schedules.
+        """
+        import sympy as sp
+        n, x = sp.symbols('n x')
+        f = func(n, x)
+
+        def values(x0, ns):
+            x_0 = sp.solve(sp.Eq(f.subs(n, 0), x0), x)[0]
+            phi = sp.lambdify(n, f.subs(x, x_0), 'numpy')
+            return np.broadcast_to(np.asarray(phi(ns), dtype=float), ns.shape)
+
+        return Schedule(values)
+
+
 class BoundaryScheduler:
-    n, x = sp.symbols('n x')
+    block_size = 1024
 
     def __init__(self, func_a, func_b, A0, B0, max_step_size):
         """
-        func_a, func_b :: (n: int, x: float) -> float, lambda expression
+        func_a, func_b: Schedule, or (n, x) -> sympy.Expr, lambda expression (see `Schedule.symbolic`)
         returns the boundary A, B of the ith step, with initial A0, B0.
+        The boundaries are tabulated in blocks, so a step is only a lookup.
         """
         self.n = 0
         self.max_step_size = max_step_size
-        n, x = BoundaryScheduler.n, BoundaryScheduler.x
+        self.schedules = [f if isinstance(f, Schedule) else Schedule.symbolic(f) for f in (func_a, func_b)]
+        self.x0 = (A0, B0)
+        self.table = []  # [(A, B) of step 1, 2, ...]
 
-        def reduce(f: sp.Expr, f0: float):
-            x0 = sp.solve(sp.Eq(f.subs(n, 0), f0), x)[0]
-            phi = f.subs(x, x0)
-            return sp.lambdify(n, phi)
+    def extend(self, size: int):
+        ns = np.arange(size + 1)
+        table = np.array([schedule.values(x0, ns) for schedule, x0 in zip(self.schedules, self.x0)])
+        # a boundary shrinks by at most max_step_size per step
+        table = np.maximum(table[:, 1:], table[:, :-1] - self.max_step_size)
+        self.table = list(zip(*table.tolist()))
 
-        self.func_a = reduce(func_a(n, x), A0)
-        self.func_b = reduce(func_b(n, x), B0)
+    def step(self):
+        self.n += 1
+        if self.n > len(self.table):
+            self.extend(max(2 * len(self.table), self.n, BoundaryScheduler.block_size))
+        return self.table[self.n - 1]
+
+    constant = Schedule.constant()
+
+    def checkpointState(self) -> dict:
+        return {'step': self.n}
+
+    def loadCheckpointState(self, checkpoint):
+        self.n = int(checkpoint['step'])
+
+
+class AdaptiveScheduler:
+    """
+    Compress B by a factor (1 - rate) per step, with A fixed. The rate adapts to the last relaxation
+    (see `Simulator.acceptCompression`): it grows after cheap relaxations of low energy, and shrinks after expensive
+    ones. If the energy or the residual force spikes, the step is rejected: the state goes back to the last frame,
+    and the step is retried at a smaller rate, unless the rate is already `min_rate`.
+    cheap_evaluations, expensive_evaluations: numbers of gradient evaluations of a relaxation
+    low_energy, low_force: floors below which the energy or the residual force is never a spike
+    """
+
+    def __init__(self, A0, B0, rate=1e-3, min_rate=1e-4, max_rate=1e-2, max_step_size=0.1, grow=1.5, shrink=0.5,
+                 cheap_evaluations=2000, expensive_evaluations=50000, low_energy=1e-2, low_force=1.0,
+                 spike_ratio=10.0):
+        self.n = 0
+        self.a, self.b = A0, B0  # the boundary of the last accepted step
+        self.rate = rate
+        self.min_rate, self.max_rate = min_rate, max_rate
+        self.max_step_size = max_step_size
+        self.grow, self.shrink = grow, shrink
+        self.cheap_evaluations, self.expensive_evaluations = cheap_evaluations, expensive_evaluations
+        self.low_energy, self.low_force = low_energy, low_force
+        self.spike_ratio = spike_ratio
+        self.last_energy, self.last_force = np.nan, np.nan
+        self.next = None
 
     def step(self):
         self.n += 1
-        a, b = self.func_a(self.n), self.func_b(self.n)
-        da, db = self.func_a(self.n - 1) - a, self.func_b(self.n - 1) - b
-        if da > self.max_step_size:
-            a = self.func_a(self.n - 1) - self.max_step_size
-        if db > self.max_step_size:
-            b = self.func_b(self.n - 1) - self.max_step_size
-        return a, b
+        self.next = (self.a, self.b - min(self.b * self.rate, self.max_step_size))
+        return self.next
 
-    @staticmethod
-    def constant(n, x):
-        return x
+    def isSpike(self, energy, max_force) -> bool:
+        if np.isnan(self.last_energy):
+            return False
+        return (energy > self.spike_ratio * max(self.last_energy, self.low_energy) or
+                max_force > self.spike_ratio * max(self.last_force, self.low_force))
+
+    def feedback(self, evaluations: int, energy: float, max_force: float) -> bool:
+        """
+        returns: whether the last step is accepted
+        """
+        if self.isSpike(energy, max_force) and self.rate > self.min_rate:
+            self.rate = max(self.rate * self.shrink, self.min_rate)
+            self.n -= 1
+            return False
+        self.a, self.b = self.next
+        self.last_energy, self.last_force = energy, max_force
+        if evaluations < self.cheap_evaluations and energy < self.low_energy:
+            self.rate = min(self.rate * self.grow, self.max_rate)
+        elif evaluations > self.expensive_evaluations:
+            self.rate = max(self.rate * self.shrink, self.min_rate)
+        return True
+
+    def checkpointState(self) -> dict:
+        return {'step': self.n, 'rate': self.rate, 'last_energy': self.last_energy, 'last_force': self.last_force}
+
+    def loadCheckpointState(self, checkpoint):
+        self.n = int(checkpoint['step'])
+        self.a, self.b = float(checkpoint['A']), float(checkpoint['B'])
+        if 'rate' in checkpoint:
+            self.rate = float(checkpoint['rate'])
+            self.last_energy, self.last_force = float(checkpoint['last_energy']), float(checkpoint['last_force'])
 
 
 class Simulator:
@@ -52,23 +176,27 @@ class Simulator:
         self.data_ptr = None
 
     @classmethod
-    def createState(cls, N, n, d, boundary_a, boundary_b, potential_name: str, data_name='data'):
+    def createState(cls, N, n, d, boundary_a, boundary_b, potential_name: str, data_name='data', threads=None):
         """
         deprecated
         """
         self = cls(N, n, d, boundary_a, boundary_b, potential_name)
         self.data_ptr = ker.createState(N, boundary_a, boundary_b)
+        if threads is not None:
+            self.setThreads(threads)
         self.id = data_name
         self.dataset = DataSet(f'{data_name}.h5', self.metadata)
         self.cnt = 0
         self.energy_cache = None
+        self.before_compress = None  # (configuration, A, B) before the last compression step
         return self
 
     @classmethod
-    def _fromCircDensity(cls, N, n, d, fraction_as_disks, initial_boundary_aspect, potential_name: str, data_name: str):
+    def _fromCircDensity(cls, N, n, d, fraction_as_disks, initial_boundary_aspect, potential_name: str, data_name: str,
+                         threads=None):
         B = np.sqrt(N / (fraction_as_disks * initial_boundary_aspect))
         A = B * initial_boundary_aspect
-        return cls.createState(N, n, d, A, B, potential_name, data_name)
+        return cls.createState(N, n, d, A, B, potential_name, data_name, threads)
 
     @classmethod
     def fromDataPtr(cls, N, n, d, boundary_a, boundary_b, potential_name: str, data_ptr: int):
@@ -107,6 +235,12 @@ class Simulator:
             self.cnt += 1
         return s
 
+    def configurationView(self) -> np.ndarray:
+        """
+        (N, 3) view of the live configuration in the kernel, without copying. Read only.
+        """
+        return ker.getStateData(self.data_ptr, self.N, copy=False)
+
     def loadDataToKernel(self, data: np.ndarray):
         """
         Assume that data is of the shape (N, 3)
@@ -135,6 +269,12 @@ class Simulator:
     def iterationSteps(self):
         return ker.getNumOfIterations(self.data_ptr)
 
+    def rebuilds(self):
+        return ker.getNumOfRebuilds(self.data_ptr)
+
+    def evaluations(self) -> (int, int):
+        return ker.getNumOfEvaluations(self.data_ptr)
+
     def residualForce(self):
         return ker.getStateResidualForce(self.data_ptr, self.N)
 
@@ -145,17 +285,83 @@ class Simulator:
         self.A, self.B = boundary_a, boundary_b
         return ker.setBoundary(self.data_ptr, boundary_a, boundary_b)
 
+    def setThreads(self, threads: int):
+        return ker.setThreads(self.data_ptr, threads)
+
+    def setVerletSkin(self, skin: float):
+        return ker.setVerletSkin(self.data_ptr, skin)
+
     def setBoundaryScheduler(self, func_a, func_b, max_step_size=0.1):
         self.boundary_scheduler = BoundaryScheduler(func_a, func_b, self.A, self.B, max_step_size)
 
+    def setAdaptiveScheduler(self, **kwargs):
+        """
+        kwargs: see `AdaptiveScheduler`
+        """
+        self.boundary_scheduler = AdaptiveScheduler(self.A, self.B, **kwargs)
+
     def compress(self):
         if self.boundary_scheduler is None:
             raise ValueError("No boundary scheduler")
+        if hasattr(self.boundary_scheduler, 'feedback'):
+            self.before_compress = (ker.getStateData(self.data_ptr, self.N), self.A, self.B)
         self.setBoundary(*self.boundary_scheduler.step())
 
+    def acceptCompression(self) -> bool:
+        """
+        Report the last relaxation to an adaptive boundary scheduler. If it rejects the compression step,
+        go back to the state before the step.
+        returns: whether the step is accepted, which is always true for a fixed scheduler
+        """
+        if not hasattr(self.boundary_scheduler, 'feedback'):
+            return True
+        evaluations, _ = self.evaluations()
+        if self.boundary_scheduler.feedback(evaluations, self.energy_cache, self.maxResidualForce()):
+            return True
+        configuration, A, B = self.before_compress
+        self.loadDataToKernel(configuration)
+        self.setBoundary(A, B)
+        return False
+
     def initAsDisks(self):
         return ker.initStateAsDisks(self.data_ptr)
 
+    # checkpoint
+
+    @property
+    def checkpoint_file(self):
+        return f'{self.id}.checkpoint.npz'
+
+    def saveCheckpoint(self):
+        """
+        Save the configuration, the boundary, the step of the boundary scheduler and the number of stored frames.
+        The file is written to a temporary file first and then renamed, so a checkpoint is never half-written.
+        """
+        self.dataset.flush()  # frames counted in the checkpoint must be in the data file
+        temp_file = f'{self.checkpoint_file}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as f:
+            np.savez(f, configuration=ker.getStateData(self.data_ptr, self.N), A=self.A, B=self.B,
+                     frames=self.cnt, **self.boundary_scheduler.checkpointState())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.checkpoint_file)
+
+    def loadCheckpoint(self) -> bool:
+        """
+        Continue from the last checkpoint. Frames stored after the checkpoint are dropped.
+        The boundary scheduler must be set as it was when the checkpoint was saved.
+        returns: whether there is a checkpoint
+        """
+        if not os.path.exists(self.checkpoint_file):
+            return False
+        with np.load(self.checkpoint_file) as checkpoint:
+            self.loadDataToKernel(checkpoint['configuration'])
+            self.setBoundary(float(checkpoint['A']), float(checkpoint['B']))
+            self.boundary_scheduler.loadCheckpointState(checkpoint)
+            self.cnt = int(checkpoint['frames'])
+        self.dataset.truncate(self.cnt)
+        return True
+
     def singleStep(self, mode: str):
         mode_id = {
             'Normal': 0,
@@ -186,6 +392,15 @@ class Simulator:
     def eqMix(self, max_iterations):
         return self.equilibriumTemplate('eqMix', max_iterations)
 
+    def eqFIRE(self, max_iterations):
+        return self.equilibriumTemplate('eqFIRE', max_iterations)
+
+    def setOptimizerParams(self, **kwargs):
+        return ker.setOptimizerParams(self.data_ptr, **kwargs)
+
+    def setFireParams(self, **kwargs):
+        return ker.setFireParams(self.data_ptr, **kwargs)
+
     # landscape
 
     def energyLandscapeAlongGradient(self, max_stepsize: float, n: int):
@@ -204,6 +419,20 @@ class Simulator:
         return ker.bestStepSize(self.data_ptr, max_stepsize)
 
 
+def equilibriumBatch(simulators: list[Simulator], method: str, max_iterations, threads: int):
+    """
+    Batched version of `Simulator.equilibriumTemplate`: simulators are relaxed on one thread pool.
+    returns: (elapse time, numbers of iterations)
+    """
+    start_t = time.perf_counter()
+    energies, iterations = ker.equilibriumBatch(
+        [s.data_ptr for s in simulators], method, np.asarray(max_iterations, dtype=int), threads)
+    end_t = time.perf_counter()
+    for s, energy in zip(simulators, energies):
+        s.energy_cache = float(energy)
+    return end_t - start_t, iterations
+
+
 class CommonSimulator:
     def __init__(self):
         self.simulator = None  # CommonSimulator does not inherit Simulator because self.simulator can be None
@@ -93,7 +93,6 @@ class State:
         simu.loadDataToKernel(self.xyt)
         return simu
 
-    # @lru_cache(maxsize=None)  # DO NOT cache this! It will cause a memory leak.
     def toSites(self, n=None):
         """
         convert each rod to disks
@@ -105,12 +104,10 @@ class State:
         xys = [xy + (k + n_shift) * uxy for k in range(0, n)]
         return np.vstack(xys)
 
-    # @lru_cache(maxsize=None)  # DO NOT cache this! It will cause a memory leak.
     def voronoiDiagram(self, n=None) -> MergedGraph:
         points = self.toSites(n)  # input of Delaunay is (n_point, n_dim)
         delaunay = Delaunay(points)
         voro_graph = Graph(len(points)).from_delaunay(delaunay.vertex_neighbor_vertices)
-        del points  # to cope with memory leak
         return voro_graph.merge(self.N)
 
     # analysis
@@ -155,13 +152,23 @@ class State:
 
     @lru_cache(maxsize=None)
     def angleDistribution(self):
-        return ut.KDE_distribution(self.t, (0, np.pi))[1]
+        return ut.KDE_distribution(self.t, (0, np.pi), periodic=True)[1]
 
     @property
     def entropyOfAngle(self) -> float:
-        x, p = ut.KDE_distribution(self.t, (0, np.pi))
+        x, p = ut.KDE_distribution(self.t, (0, np.pi), periodic=True)
         return ut.entropyOf(p) * (x[1] - x[0])
 
+    def observables(self, props: list[str]) -> dict:
+        """
+        several observables of this frame. Observables computed by the kernel are computed in one kernel call,
+        so that the collision detection and the Delaunay triangulation are done once for all of them.
+        """
+        from src.kernel import ker
+        kernel_props = [prop for prop in props if prop in ker.observable_ids]
+        values = self.toCpp().observables_(kernel_props) if kernel_props else {}
+        return {prop: values[prop] if prop in values else getattr(self, prop) for prop in props}
+
     # analysis with cpp
 
     def toCpp(self):
@@ -191,14 +198,9 @@ class State:
     @property
     def neighborAngleDist(self):
         # return self.toCpp().neighborAngleDist_(180)
-        graph = self.voronoiDiagram(3)
-        lst = []
-        for i in range(self.N):
-            for j in graph.lst[i]:
-                if i < j:
-                    lst.append((self.t[i] - self.t[j]) % (np.pi / 2))
-        graph.free_memory()
-        return np.histogram(lst, bins=180)[0]
+        i, j = self.voronoiDiagram(3).edges.T
+        t = self.t
+        return np.histogram((t[i] - t[j]) % (np.pi / 2), bins=180)[0]
 
     @lru_cache(maxsize=None)
     def SiDistribution(self):
@@ -8,7 +8,6 @@ from functools import reduce
 
 import numpy as np
 import pandas as pd
-from scipy.stats import gaussian_kde
 
 bins_of_distribution = 500
 
@@ -36,13 +35,13 @@ def map2(func, lst):
     return [func(lst[i], lst[i + 1]) for i in range(len(lst) - 1)]
 
 
-def getFileHash(path):
+def getFileHash(path, chunk_size=1 << 24):
     hash_obj = hashlib.sha256()
     with open(path, 'rb') as f:
-        chunk = f.read(8192)
+        chunk = f.read(chunk_size)
         while chunk:
             hash_obj.update(chunk)
-            chunk = f.read(8192)
+            chunk = f.read(chunk_size)
     return hash_obj.hexdigest()
 
 
@@ -144,15 +143,61 @@ def entropyOf(dist: np.ndarray) -> float:
     return -np.dot(dist, safe_log(dist))
 
 
-def KDE_distribution(data: np.ndarray, interval: (float, float)) -> (np.ndarray, np.ndarray):
+def KDE_distribution(data: np.ndarray, interval: (float, float), periodic=False) -> (np.ndarray, np.ndarray):
     """
     return: (xs: np.ndarray, distribution: np.ndarray)
     """
-    length = interval[1] - interval[0]
-    kde = gaussian_kde(data, bw_method=length / bins_of_distribution * 4)
-    x_grid = np.linspace(*interval, bins_of_distribution)
-    p_x = kde.evaluate(x_grid)
-    return x_grid, p_x
+    x_grid, p_x = KDE_distributions([data], interval, periodic)
+    return x_grid, p_x[0]
+
+
+def KDE_distributions(data: list[np.ndarray], interval: (float, float), periodic=False,
+                      oversample=8) -> (np.ndarray, np.ndarray):
+    """
+    Gaussian KDE of many samples (e.g. one per frame) at once, with the bandwidth of
+    `gaussian_kde(sample, bw_method=length / bins_of_distribution * 4)`.
+    Each sample is linearly binned on a grid `oversample` times finer than the output,
+    and convolved with its Gaussian kernel by FFT.
+    periodic: wrap the kernel around the interval, e.g. for angles in [0, pi).
+        Otherwise, the grid is zero-padded to the double length, so nothing wraps around.
+    return: (xs: np.ndarray of bins_of_distribution, distributions: np.ndarray of (samples, bins_of_distribution))
+    """
+    lower, upper = interval
+    length = upper - lower
+    m = bins_of_distribution * oversample  # fine grid points on the interval
+    dx = length / m
+    size = m if periodic else 2 * m
+    # linear binning of all samples in one pass: sample k goes to the row k of a (samples, size) array
+    counts = np.array([len(sample) for sample in data], dtype=int)
+    values = np.concatenate([np.zeros(0)] + [np.asarray(sample, dtype=float).ravel() for sample in data])
+    rows = np.repeat(np.arange(len(data)), counts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(rows, values, minlength=len(data)) / counts
+        variances = np.bincount(rows, (values - means[rows]) ** 2, minlength=len(data)) / (counts - 1)
+    sigmas = (length / bins_of_distribution * 4 * np.sqrt(variances))[:, None]
+    weights = 1 / counts[rows]
+    pos = (values - lower) / dx
+    left = np.floor(pos)
+    frac = pos - left
+    left = left.astype(int)
+    if periodic:
+        left %= size
+    else:
+        left = np.clip(left, 0, size - 2)
+    right = (left + 1) % size
+    hist = (np.bincount(rows * size + left, (1 - frac) * weights, minlength=len(data) * size) +
+            np.bincount(rows * size + right, frac * weights, minlength=len(data) * size)).reshape(len(data), size)
+    freqs = np.fft.rfftfreq(size, d=dx)
+    density = np.fft.irfft(np.fft.rfft(hist, axis=1) * np.exp(-2 * (np.pi * sigmas * freqs) ** 2), n=size, axis=1)
+    density = np.maximum(density, 0) / dx
+    # interpolate the fine grid at the output points
+    x_grid = np.linspace(lower, upper, bins_of_distribution)
+    pos = (x_grid - lower) / dx
+    left = np.floor(pos).astype(int)
+    frac = pos - left
+    right = (left + 1) % size
+    left %= size
+    return x_grid, density[:, left] * (1 - frac) + density[:, right] * frac
 
 
 def BIN_distribution(data: np.ndarray) -> (np.ndarray, np.ndarray):
@@ -8,6 +8,7 @@ import pandas as pd
 import src.art as art
 import src.utils as ut
 from analysis import InteractiveViewer, RenderPipe, CurveManager, Distribution
+from src.dataindex import DataIndex, ParallelMap, summarize
 from src.myio import DataSet
 from src.render import StateRenderer
 from src.state import State
@@ -18,8 +19,12 @@ from src.state import State
 
 
 class DataViewer:
-    def __init__(self, datasets: list[DataSet]):
+    def __init__(self, datasets: list[DataSet], broken_files: list[tuple[str, str]] = None):
+        """
+        broken_files: (file, error) of data files that cannot be loaded, see `brokenReport`
+        """
         self.datasets = list(filter(lambda x: len(x) > 0, datasets))
+        self.broken_files = broken_files if broken_files is not None else []
         self.initDensityCurveTemplates()
         self.sort()
 
@@ -28,9 +33,7 @@ class DataViewer:
 
     @property
     def _abstract(self):
-        df = pd.DataFrame()
-        for d in self.datasets:
-            df = pd.concat([df, d.toDataFrame()], ignore_index=True)
+        df = pd.DataFrame([d.abstract() for d in self.datasets])
         return df.round(5)  # 5 digits, for comparison between floats
 
     @property
@@ -55,6 +58,9 @@ class DataViewer:
         print(self.abstract)
         return self
 
+    def brokenReport(self) -> pd.DataFrame:
+        return pd.DataFrame(self.broken_files, columns=['file', 'error'])
+
     def printall(self):
         print(self.abstract.to_string())
         return self
@@ -165,8 +171,27 @@ def collectResultFiles(path: str):
     return [os.path.abspath(file) for file in files]
 
 
-def loadAll(target_dir: str):
+def loadAll(target_dir: str, use_index=True, workers: int = None, progress=True):
+    """
+    use_index: list data files by the index of each directory (see `DataIndex`), which is updated incrementally
+    workers: number of processes to read data files. The default is the number of cores, and 1 means serial.
+    Broken files are not printed one by one, but collected in `DataViewer.brokenReport()`.
+    """
     data_files = collectResultFiles(target_dir)
-    ds = ut.Map('Debug')(DataSet.loadFrom, data_files)
-    ds = list(filter(lambda x: x is not None, ds))
-    return DataViewer(ds)
+    ds, broken_files = [], []
+    with ParallelMap(workers, progress) as pmap:
+        if use_index:
+            directories = sorted(set(os.path.dirname(file) for file in data_files))
+            for directory in directories:
+                index = DataIndex(directory)
+                ds.extend(index.datasets(pmap))
+                broken_files.extend(index.broken)
+        else:
+            for file, (metadata, summary, error) in zip(data_files, pmap(summarize, data_files)):
+                if error is not None:
+                    broken_files.append((file, error))
+                else:
+                    ds.append(DataSet.fromSummary(file, metadata, summary))
+    if broken_files:
+        print(f'{len(broken_files)} broken data files. See DataViewer.brokenReport().')
+    return DataViewer(ds, broken_files)